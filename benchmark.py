@@ -0,0 +1,323 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+from aiohttp import ClientSession, web
+from tabulate import tabulate
+
+from main import NM, TG, DeliveryQueue, RateLimiter, StateStore, Subscriber, additions, client_session, updates
+
+GAME = "benchgame"
+
+
+class FakeNexus:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.generation = 0
+        self.stats = {"nexus_api": 0, "nexus_web": 0, "telegram": 0, "not_modified": 0, "errors": 0}
+        self.categories = [{"category_id": id, "name": f"Category {id}"} for id in range(1, 21)]
+
+        self.latest_mod_ids = list(range(1, args.latest + 1))
+        self.next_mod_id = args.latest + 1
+        self.tracked_mod_ids = list(range(1, args.tracked + 1))
+        self.versions = {
+            mod_id: [f"1.0.{entry}" for entry in range(args.changelog_entries)] for mod_id in self.tracked_mod_ids
+        }
+        self.file_updates = {mod_id: 1_700_000_000 + mod_id for mod_id in self.tracked_mod_ids}
+
+        padding = "<p>" + "Lorem ipsum dolor sit amet. " * 2000 + "</p>"
+        images = "".join(
+            f'<li class="thumb"><figure><a class="mod-image" href="https://images.invalid/{index}.jpg">'
+            f'<img src="https://images.invalid/{index}_thumb.jpg"></a></figure></li>'
+            for index in range(5)
+        )
+        self.mod_page = f'<html><body>{padding}<ul class="thumbgallery">{images}</ul>{padding}</body></html>'
+
+    def advance(self, changes: int) -> None:
+        # New mods are published and some of the tracked ones get a new version
+        self.generation += 1
+        new_mod_ids = list(range(self.next_mod_id, self.next_mod_id + changes))
+        # Like the API, the latest added list keeps its length, so a large burst pushes mods out of it
+        self.latest_mod_ids = (self.latest_mod_ids + new_mod_ids)[-self.args.latest :]
+        self.next_mod_id += changes
+        for mod_id in random.sample(self.tracked_mod_ids, min(changes, len(self.tracked_mod_ids))):
+            self.versions[mod_id].append(f"1.1.{self.generation}")
+            self.file_updates[mod_id] += 1000 * self.generation
+
+    def mod(self, mod_id: int) -> dict[str, Any]:
+        return {
+            "mod_id": mod_id,
+            "name": f"Benchmark Mod {mod_id}",
+            "summary": "A mod used for benchmarking.<br />It does nothing.",
+            "version": self.versions[mod_id][-1] if mod_id in self.versions else "1.0.0",
+            "author": f"Author {mod_id % 50}",
+            "category_id": mod_id % 20 + 1,
+            "domain_name": GAME,
+            "available": True,
+            "contains_adult_content": mod_id % 10 == 0,
+        }
+
+    @web.middleware
+    async def middleware(self, request: web.Request, handler: Callable[[web.Request], Awaitable[Any]]) -> Any:
+        if request.path.startswith("/_"):
+            return await handler(request)
+
+        if request.path.startswith("/v1/"):
+            self.stats["nexus_api"] += 1
+        elif request.path.startswith("/bot"):
+            self.stats["telegram"] += 1
+        else:
+            self.stats["nexus_web"] += 1
+
+        if self.args.latency:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.args.latency / 1000)
+        if random.random() < self.args.error_rate:
+            self.stats["errors"] += 1
+            if request.path.startswith("/bot"):
+                return web.json_response({"ok": False, "error_code": 500, "description": "Fake error"}, status=500)
+            return web.json_response({"code": 500, "message": "Fake error"}, status=500)
+
+        response = await handler(request)
+        response.headers.update(
+            {
+                "X-RL-Hourly-Limit": "100000",
+                "X-RL-Hourly-Remaining": "100000",
+                "X-RL-Daily-Limit": "1000000",
+                "X-RL-Daily-Remaining": "1000000",
+            }
+        )
+        return response
+
+    def cached(self, request: web.Request, data: Any) -> web.Response:
+        etag = f'"{self.generation}"'
+        if request.headers.get("If-None-Match") == etag:
+            self.stats["not_modified"] += 1
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.json_response(data, headers={"ETag": etag})
+
+    async def games(self, request: web.Request) -> web.Response:
+        return web.json_response([{"domain_name": GAME, "categories": self.categories}])
+
+    async def game(self, request: web.Request) -> web.Response:
+        return web.json_response({"domain_name": request.match_info["game"], "categories": self.categories})
+
+    async def latest_added(self, request: web.Request) -> web.Response:
+        return self.cached(request, [self.mod(mod_id) for mod_id in reversed(self.latest_mod_ids)])
+
+    async def updated(self, request: web.Request) -> web.Response:
+        return self.cached(
+            request,
+            [
+                {"mod_id": mod_id, "latest_file_update": file_update, "latest_mod_activity": file_update}
+                for mod_id, file_update in self.file_updates.items()
+            ],
+        )
+
+    async def tracked_mods(self, request: web.Request) -> web.Response:
+        return self.cached(request, [{"mod_id": mod_id, "domain_name": GAME} for mod_id in self.tracked_mod_ids])
+
+    async def mod_details(self, request: web.Request) -> web.Response:
+        return web.json_response(self.mod(int(request.match_info["mod_id"])))
+
+    async def changelogs(self, request: web.Request) -> web.Response:
+        versions = self.versions.get(int(request.match_info["mod_id"]), [])
+        return web.json_response({version: [f"Changes in {version}", "Bug fixes"] for version in versions})
+
+    async def mod_page_html(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.mod_page, content_type="text/html")
+
+    async def telegram(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        if request.match_info["method"] == "sendMediaGroup":
+            result: Any = [
+                {
+                    "message_id": index,
+                    "photo": [{"file_id": "file-" + photo["media"].removeprefix("file-"), "width": 100, "height": 100}],
+                }
+                for index, photo in enumerate(data["media"])
+            ]
+        else:
+            result = {"message_id": 1}
+        return web.json_response({"ok": True, "result": result})
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+    async def post_advance(self, request: web.Request) -> web.Response:
+        self.advance(int(request.query["changes"]))
+        return web.json_response(self.stats)
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self.middleware], client_max_size=10 * 1024**2)
+        app.add_routes(
+            [
+                web.get("/_stats", self.get_stats),
+                web.post("/_advance", self.post_advance),
+                web.get("/v1/games.json", self.games),
+                web.get("/v1/games/{game}.json", self.game),
+                web.get("/v1/user/tracked_mods.json", self.tracked_mods),
+                web.get("/v1/games/{game}/mods/latest_added.json", self.latest_added),
+                web.get("/v1/games/{game}/mods/updated.json", self.updated),
+                web.get("/v1/games/{game}/mods/{mod_id:\\d+}.json", self.mod_details),
+                web.get("/v1/games/{game}/mods/{mod_id:\\d+}/changelogs.json", self.changelogs),
+                web.get("/{game}/mods/{mod_id:\\d+}", self.mod_page_html),
+                web.post("/bot{token}/{method}", self.telegram),
+            ]
+        )
+        return app
+
+
+def run_server(args: argparse.Namespace) -> None:
+    web.run_app(FakeNexus(args).app(), host="127.0.0.1", port=args.port, print=None)
+
+
+async def server_stats(session: ClientSession, base_url: str) -> dict[str, int]:
+    async with session.get(f"{base_url}/_stats") as response:
+        return await response.json()  # type: ignore[no-any-return]
+
+
+async def benchmark_feed(feed: str, args: argparse.Namespace) -> list[dict[str, Any]]:
+    base_url = f"http://127.0.0.1:{args.port}"
+    rows = []
+
+    if not args.telegram_pacing:
+        DeliveryQueue.chat_interval = staticmethod(lambda chat_id: 0.0)  # type: ignore[method-assign]
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = StateStore(Path(directory) / "state.db")
+        async with client_session() as session, client_session() as web_session, client_session() as tg_session:
+            nm = NM(
+                "benchmark",
+                session,
+                RateLimiter(rate=args.rate_limit, burst=int(args.rate_limit)),
+                store,
+                web_session=web_session,
+            )
+            nm.api_url = f"{base_url}/v1"
+            nm.web_url = base_url
+            tg = TG(tg_session, "benchmark")
+            tg.api_url = base_url
+            queue = DeliveryQueue(tg, store, global_rate=args.telegram_rate, digest_threshold=args.digest_threshold)
+            subscribers = [Subscriber(str(chat_id)) for chat_id in range(1, args.chats + 1)]
+
+            async def measure(name: str, run: Callable[[], Awaitable[Any]]) -> Any:
+                before = await server_stats(session, base_url)
+                started = time.perf_counter()
+                result = await run()
+                cycle_time = time.perf_counter() - started
+
+                messages = store.pending_deliveries()
+                started = time.perf_counter()
+                await queue.drain()
+                send_time = time.perf_counter() - started
+                after = await server_stats(session, base_url)
+
+                rows.append(
+                    {
+                        "Feed": feed,
+                        "Cycle": name,
+                        "Cycle time (s)": round(cycle_time, 3),
+                        "API requests": after["nexus_api"] - before["nexus_api"],
+                        "304s": after["not_modified"] - before["not_modified"],
+                        "Page requests": after["nexus_web"] - before["nexus_web"],
+                        "Errors": after["errors"] - before["errors"],
+                        "Messages": messages,
+                        "Msgs/s": round(messages / send_time, 1) if messages else 0,
+                        "Peak RSS (MB)": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                    }
+                )
+                return result
+
+            feed_function = additions if feed == "additions" else updates
+            try:
+                check = await measure(
+                    "setup",
+                    lambda: feed_function(
+                        nm=nm,
+                        queue=queue,
+                        store=store,
+                        game_domain_name=GAME,
+                        subscribers=subscribers,
+                        concurrency=args.concurrency,
+                    ),
+                )
+                for cycle in range(1, args.cycles + 1):
+                    if cycle > 1:
+                        async with session.post(f"{base_url}/_advance", params={"changes": args.changes}):
+                            pass
+                    await measure(str(cycle), check)
+            except Exception as e:
+                print(f"{feed} failed after {len(rows)} cycle/s: {e!r}", file=sys.stderr)
+        store.close()
+    return rows
+
+
+async def wait_for_server(base_url: str) -> None:
+    async with ClientSession() as session:
+        for _ in range(50):
+            try:
+                await server_stats(session, base_url)
+                return
+            except OSError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"Fake server at {base_url} did not start")
+
+
+def run_benchmark(feed: str, args: argparse.Namespace) -> list[dict[str, Any]]:
+    if args.verbose:
+        return asyncio.run(benchmark_feed(feed, args))
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        return asyncio.run(benchmark_feed(feed, args))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the notifier against a local fake Nexus Mods / Telegram")
+    parser.add_argument("feeds", nargs="*", metavar="feed", help="Feeds to run: additions, updates (default: all)")
+    parser.add_argument("--latest", type=int, default=100, help="Number of mods in the latest added list")
+    parser.add_argument("--tracked", type=int, default=1000, help="Number of tracked mods")
+    parser.add_argument("--changelog-entries", type=int, default=10, help="Number of changelog entries per mod")
+    parser.add_argument("--changes", type=int, default=20, help="New and updated mods between cycles")
+    parser.add_argument("--cycles", type=int, default=3, help="Number of check cycles per feed")
+    parser.add_argument("--chats", type=int, default=1, help="Number of subscribed chats")
+    parser.add_argument("--latency", type=float, default=20, help="Average server latency in ms")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of requests answered with an error")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum number of concurrent per-mod requests")
+    parser.add_argument("--rate-limit", type=float, default=1000, help="Maximum API requests per second")
+    parser.add_argument("--telegram-rate", type=float, default=1000, help="Maximum Telegram messages per second")
+    parser.add_argument("--digest-threshold", type=int, default=0, help="Queued mods per chat that trigger a digest")
+    parser.add_argument("--telegram-pacing", action="store_true", help="Keep the per chat pacing of Telegram messages")
+    parser.add_argument("--port", type=int, default=8765, help="Port of the fake server")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show the output of the notifier")
+    args = parser.parse_args()
+    # Validated here, argparse's choices don't allow an empty list for nargs="*"
+    for feed in args.feeds:
+        if feed not in ("additions", "updates"):
+            parser.error(f"argument feed: invalid choice: {feed!r} (choose from 'additions', 'updates')")
+
+    server = multiprocessing.Process(target=run_server, args=(args,), daemon=True)
+    server.start()
+    asyncio.run(wait_for_server(f"http://127.0.0.1:{args.port}"))
+
+    # Every feed runs in a fresh process so the peak RSS of one doesn't hide the other
+    rows = []
+    try:
+        for feed in dict.fromkeys(args.feeds or ["additions", "updates"]):
+            with multiprocessing.Pool(1) as pool:
+                rows.extend(pool.apply(run_benchmark, (feed, args)))
+    finally:
+        server.terminate()
+
+    print(tabulate(rows, headers="keys", tablefmt="pretty"))
+
+
+if __name__ == "__main__":
+    main()
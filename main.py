@@ -1,86 +1,917 @@
 import argparse
 import asyncio
+import bisect
+import codecs
+import heapq
+import itertools
 import json
+import math
+import random
 import re
+import signal
+import sqlite3
+import sys
 import time
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager, suppress
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from functools import lru_cache, partial
+from html.parser import HTMLParser
 from pathlib import Path
-from typing import Any, Literal
+from typing import Any, Awaitable, Callable, ClassVar, Iterable, Iterator, Literal, TypeVar
 
-from aiohttp import ClientSession
-from bs4 import BeautifulSoup
+from aiohttp import ClientError, ClientResponse, ClientSession, ClientTimeout, TCPConnector, web
 from tabulate import tabulate
 
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads  # type: ignore[assignment]
+
+T = TypeVar("T")
+
+ID_PATTERN = re.compile(r"/\d+")
+TAG_SEPARATOR_PATTERN = re.compile(r"[ -/]")
+LINE_BREAK_PATTERN = re.compile(r"(?:<br />|\n)+")
+TAG_PATTERN = re.compile(r"<(/?)([a-zA-Z]+)[^>]*?(/?)>")
+PARTIAL_MARKUP_PATTERN = re.compile(r"(?:<[^>]*|&[#\w]*)$")
+
+# Telegram's limits for media captions and messages
+CAPTION_LIMIT = 1024
+MESSAGE_LIMIT = 4096
+
+# Fields pushed mod events need per feed, with their types (an event missing one would fail the check later)
+PUSHED_EVENT_FIELDS: dict[str, dict[str, type]] = {
+    "additions": {
+        "mod_id": int,
+        "domain_name": str,
+        "author": str,
+        "summary": str,
+        "category_id": int,
+        "available": bool,
+        "contains_adult_content": bool,
+    },
+    "updates": {"mod_id": int, "latest_file_update": int},
+}
+
+# Priority of the API requests made by the current task, requests of busier games are served first
+request_priority: ContextVar[float] = ContextVar("request_priority", default=0.0)
+
+
+class Metrics:
+    buckets = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+    def __init__(self) -> None:
+        self.types: dict[str, tuple[str, str]] = {}
+        self.counters: dict[str, dict[tuple[tuple[str, str], ...], float]] = defaultdict(lambda: defaultdict(float))
+        self.histograms: dict[str, dict[tuple[tuple[str, str], ...], list[float]]] = defaultdict(dict)
+        self.gauges: dict[str, Callable[[], dict[tuple[tuple[str, str], ...], float]]] = {}
+
+    def inc(self, name: str, help: str, value: float = 1, **labels: Any) -> None:
+        self.types.setdefault(name, ("counter", help))
+        self.counters[name][tuple(sorted((key, str(value)) for key, value in labels.items()))] += value
+
+    def observe(self, name: str, help: str, value: float, **labels: Any) -> None:
+        self.types.setdefault(name, ("histogram", help))
+        key = tuple(sorted((key, str(value)) for key, value in labels.items()))
+        # Bucket counts followed by the sum and the count of all observations
+        histogram = self.histograms[name].setdefault(key, [0.0] * (len(self.buckets) + 2))
+        histogram[bisect.bisect_left(self.buckets, value)] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+    @contextmanager
+    def time(self, name: str, help: str, **labels: Any) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, help, time.perf_counter() - started, **labels)
+
+    def gauge(self, name: str, help: str, callback: Callable[[], dict[tuple[tuple[str, str], ...], float]]) -> None:
+        # Gauges are read when rendering, so they never go stale
+        self.types[name] = ("gauge", help)
+        self.gauges[name] = callback
+
+    @staticmethod
+    def _labels(labels: Iterable[tuple[str, str]]) -> str:
+        text = ",".join(f'{key}="{value}"' for key, value in labels)
+        return "{" + text + "}" if text else ""
+
+    def render(self) -> str:
+        lines = []
+        for name, (type, help) in sorted(self.types.items()):
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {type}"]
+            if type == "counter":
+                for labels, value in self.counters[name].items():
+                    lines.append(f"{name}{self._labels(labels)} {value}")
+            elif type == "gauge":
+                for labels, value in self.gauges[name]().items():
+                    lines.append(f"{name}{self._labels(labels)} {value}")
+            else:
+                for labels, histogram in self.histograms[name].items():
+                    cumulative = 0.0
+                    for bucket, count in zip((*self.buckets, "+Inf"), histogram):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{self._labels((*labels, ('le', str(bucket))))} {cumulative}")
+                    lines.append(f"{name}_sum{self._labels(labels)} {histogram[-2]}")
+                    lines.append(f"{name}_count{self._labels(labels)} {histogram[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str | Path) -> None:
+        # Write atomically, the node exporter textfile collector may read the file at any time
+        path = Path(path)
+        temp_path = path.with_suffix(path.suffix + ".tmp")
+        temp_path.write_text(self.render())
+        temp_path.replace(path)
+
+    async def write_periodically(self, path: str | Path, interval: float = 15) -> None:
+        while True:
+            self.write(path)
+            await asyncio.sleep(interval)
+
+    async def serve(self, port: int) -> web.AppRunner:
+        async def handle(request: web.Request) -> web.Response:
+            return web.Response(text=self.render(), content_type="text/plain", charset="utf-8")
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, port=port).start()
+        print(f"Serving metrics on port {port}")
+        return runner
+
+
+metrics = Metrics()
+
+
+@dataclass(slots=True)
+class TrackedModState:
+    version: str | None
+    latest_file_update: int | None
+    is_adult: bool = False
+
+
+@dataclass(slots=True, frozen=True)
+class Category:
+    category_id: int
+    name: str
+
+
+@dataclass(slots=True)
+class ModSummary:
+    headers: ClassVar[tuple[str, ...]] = ("ID", "Author", "Name", "Category", "Link")
+
+    mod_id: int
+    game: str
+    name: str
+    author: str
+    category: str
+    is_adult: bool
+
+    @classmethod
+    def from_api(cls, mod: dict[str, Any], category: Category) -> "ModSummary":
+        return cls(
+            mod["mod_id"],
+            mod["domain_name"],
+            mod.get("name") or "N/A",
+            mod["author"],
+            category.name,
+            mod["contains_adult_content"],
+        )
+
+    @property
+    def link(self) -> str:
+        return f"https://nexusmods.com/{self.game}/mods/{self.mod_id}"
+
+    def row(self) -> tuple[Any, ...]:
+        return (self.mod_id, self.author, self.name, self.category, self.link)
+
+
+class StateStore:
+    def __init__(self, db_file: str | Path = "state.db") -> None:
+        # Worker processes share the database, so wait for each other's writes instead of failing right away
+        self.connection = sqlite3.connect(db_file, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS seen_mods (
+                game TEXT NOT NULL,
+                mod_id INTEGER NOT NULL,
+                seen_at REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (game, mod_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS tracked_mods (
+                game TEXT NOT NULL,
+                mod_id INTEGER NOT NULL,
+                version TEXT,
+                latest_file_update INTEGER,
+                is_adult INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (game, mod_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS mod_versions (
+                game TEXT NOT NULL,
+                mod_id INTEGER NOT NULL,
+                version TEXT NOT NULL,
+                PRIMARY KEY (game, mod_id, version)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS categories (
+                game TEXT NOT NULL,
+                category_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                PRIMARY KEY (game, category_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS feed_runs (
+                game TEXT NOT NULL,
+                feed TEXT NOT NULL,
+                last_run REAL NOT NULL,
+                PRIMARY KEY (game, feed)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS http_cache (
+                key TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                body TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id TEXT NOT NULL,
+                method TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                not_before REAL NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS outbox_chat_id ON outbox (chat_id, id);
+            """)
+        # Databases created before mods were pruned by the time they were seen get the column, their mods count as old
+        if "seen_at" not in {column for _, column, *_ in self.connection.execute("PRAGMA table_info(seen_mods)")}:
+            self.connection.execute("ALTER TABLE seen_mods ADD COLUMN seen_at REAL NOT NULL DEFAULT 0")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS seen_mods_seen_at ON seen_mods (game, seen_at)")
+        self.depth = 0
+
+    def close(self) -> None:
+        self.connection.close()
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        # Writes inside a transaction are committed with the outermost one, so a check's queued messages and the state
+        # it advances are saved together or not at all
+        self.depth += 1
+        try:
+            if self.depth > 1:
+                yield
+            else:
+                with self.connection:
+                    yield
+        finally:
+            self.depth -= 1
+
+    def seen_mods(self, game_domain_name: str) -> set[int]:
+        rows = self.connection.execute("SELECT mod_id FROM seen_mods WHERE game = ?", (game_domain_name,))
+        return {mod_id for (mod_id,) in rows}
+
+    def add_seen_mods(self, game_domain_name: str, mod_ids: Iterable[int], keep: int = 1000) -> None:
+        with (
+            self.transaction(),
+            metrics.time("state_save_duration_seconds", "Duration of state database writes", table="seen_mods"),
+        ):
+            seen_at = time.time()
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO seen_mods (game, mod_id, seen_at) VALUES (?, ?, ?)",
+                ((game_domain_name, mod_id, seen_at) for mod_id in mod_ids),
+            )
+            # Only recently seen mods can show up in the latest added list again, so drop the ones seen longest ago.
+            # Mod IDs are given out when a draft is created, so a mod published late can have a much older ID.
+            self.connection.execute(
+                """
+                DELETE FROM seen_mods WHERE game = ? AND mod_id NOT IN (
+                    SELECT mod_id FROM seen_mods WHERE game = ? ORDER BY seen_at DESC, mod_id DESC LIMIT ?
+                )
+                """,
+                (game_domain_name, game_domain_name, keep),
+            )
+
+    def tracked_mods(self, game_domain_name: str) -> dict[int, TrackedModState]:
+        rows = self.connection.execute(
+            "SELECT mod_id, version, latest_file_update, is_adult FROM tracked_mods WHERE game = ?",
+            (game_domain_name,),
+        )
+        return {
+            mod_id: TrackedModState(version, latest_file_update, bool(is_adult))
+            for mod_id, version, latest_file_update, is_adult in rows
+        }
+
+    def save_tracked_mods(self, game_domain_name: str, mods: dict[int, TrackedModState]) -> None:
+        with (
+            self.transaction(),
+            metrics.time("state_save_duration_seconds", "Duration of state database writes", table="tracked_mods"),
+        ):
+            self.connection.executemany(
+                """
+                INSERT INTO tracked_mods (game, mod_id, version, latest_file_update, is_adult)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (game, mod_id) DO UPDATE SET
+                    version = excluded.version,
+                    latest_file_update = excluded.latest_file_update,
+                    is_adult = excluded.is_adult
+                """,
+                (
+                    (game_domain_name, mod_id, mod.version, mod.latest_file_update, mod.is_adult)
+                    for mod_id, mod in mods.items()
+                ),
+            )
+
+    def mod_versions(self, game_domain_name: str, mod_ids: Iterable[int]) -> dict[int, set[str]]:
+        return {
+            mod_id: {
+                version
+                for (version,) in self.connection.execute(
+                    "SELECT version FROM mod_versions WHERE game = ? AND mod_id = ?", (game_domain_name, mod_id)
+                )
+            }
+            for mod_id in mod_ids
+        }
+
+    def add_mod_versions(self, game_domain_name: str, versions: dict[int, set[str]]) -> None:
+        with (
+            self.transaction(),
+            metrics.time("state_save_duration_seconds", "Duration of state database writes", table="mod_versions"),
+        ):
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO mod_versions (game, mod_id, version) VALUES (?, ?, ?)",
+                (
+                    (game_domain_name, mod_id, version)
+                    for mod_id, mod_versions in versions.items()
+                    for version in mod_versions
+                ),
+            )
+
+    def categories(self, game_domain_name: str) -> dict[int, Category]:
+        rows = self.connection.execute("SELECT category_id, name FROM categories WHERE game = ?", (game_domain_name,))
+        return {category_id: Category(category_id, name) for category_id, name in rows}
+
+    def save_categories(self, categories: dict[str, dict[int, Category]]) -> None:
+        with (
+            self.transaction(),
+            metrics.time("state_save_duration_seconds", "Duration of state database writes", table="categories"),
+        ):
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO categories (game, category_id, name) VALUES (?, ?, ?)",
+                (
+                    (game_domain_name, category.category_id, category.name)
+                    for game_domain_name, game_categories in categories.items()
+                    for category in game_categories.values()
+                ),
+            )
+
+    def last_run(self, game_domain_name: str, feed: str) -> float | None:
+        row = self.connection.execute(
+            "SELECT last_run FROM feed_runs WHERE game = ? AND feed = ?", (game_domain_name, feed)
+        ).fetchone()
+        return row[0] if row else None
+
+    def save_last_run(self, game_domain_name: str, feed: str, last_run: float) -> None:
+        with self.transaction():
+            self.connection.execute(
+                "INSERT OR REPLACE INTO feed_runs (game, feed, last_run) VALUES (?, ?, ?)",
+                (game_domain_name, feed, last_run),
+            )
+
+    def http_cache_entry(self, key: str) -> dict[str, Any] | None:
+        row = self.connection.execute(
+            "SELECT etag, last_modified, body FROM http_cache WHERE key = ?", (key,)
+        ).fetchone()
+        return {"etag": row[0], "last_modified": row[1], "body": row[2]} if row else None
+
+    def http_cache_validators(self, key: str) -> tuple[str | None, str | None] | None:
+        row = self.connection.execute("SELECT etag, last_modified FROM http_cache WHERE key = ?", (key,)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def save_http_cache_entry(self, key: str, etag: str | None, last_modified: str | None, body: bytes) -> None:
+        with (
+            self.transaction(),
+            metrics.time("state_save_duration_seconds", "Duration of state database writes", table="http_cache"),
+        ):
+            self.connection.execute(
+                "INSERT OR REPLACE INTO http_cache (key, etag, last_modified, body) VALUES (?, ?, ?, ?)",
+                (key, etag, last_modified, body),
+            )
+
+    def enqueue_delivery(self, chat_id: str, method: str, payload: dict[str, Any]) -> None:
+        with (
+            self.transaction(),
+            metrics.time("state_save_duration_seconds", "Duration of state database writes", table="outbox"),
+        ):
+            self.connection.execute(
+                "INSERT INTO outbox (chat_id, method, payload) VALUES (?, ?, ?)", (chat_id, method, json.dumps(payload))
+            )
+
+    def next_delivery(self, chat_id: str) -> dict[str, Any] | None:
+        row = self.connection.execute(
+            "SELECT id, method, payload, attempts, not_before FROM outbox WHERE chat_id = ? ORDER BY id LIMIT 1",
+            (chat_id,),
+        ).fetchone()
+        if not row:
+            return None
+        id, method, payload, attempts, not_before = row
+        return {
+            "id": id,
+            "method": method,
+            "payload": json.loads(payload),
+            "attempts": attempts,
+            "not_before": not_before,
+        }
+
+    def deliveries(self, chat_id: str, method: str) -> list[dict[str, Any]]:
+        rows = self.connection.execute(
+            "SELECT id, payload FROM outbox WHERE chat_id = ? AND method = ? ORDER BY id", (chat_id, method)
+        )
+        return [{"id": id, "payload": json.loads(payload)} for id, payload in rows]
+
+    def count_deliveries(self, chat_id: str, method: str) -> int:
+        return self.connection.execute(  # type: ignore[no-any-return]
+            "SELECT COUNT(*) FROM outbox WHERE chat_id = ? AND method = ?", (chat_id, method)
+        ).fetchone()[0]
+
+    def replace_deliveries(self, ids: list[int], chat_id: str, method: str, payloads: list[dict[str, Any]]) -> None:
+        with (
+            self.transaction(),
+            metrics.time("state_save_duration_seconds", "Duration of state database writes", table="outbox"),
+        ):
+            self.connection.executemany("DELETE FROM outbox WHERE id = ?", ((id,) for id in ids))
+            self.connection.executemany(
+                "INSERT INTO outbox (chat_id, method, payload) VALUES (?, ?, ?)",
+                ((chat_id, method, json.dumps(payload)) for payload in payloads),
+            )
+
+    def pending_deliveries(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]  # type: ignore[no-any-return]
+
+    def delivery_chats(self) -> list[str]:
+        return [chat_id for (chat_id,) in self.connection.execute("SELECT DISTINCT chat_id FROM outbox")]
+
+    def delete_delivery(self, id: int) -> None:
+        with self.transaction():
+            self.connection.execute("DELETE FROM outbox WHERE id = ?", (id,))
+
+    def retry_delivery(self, id: int, attempts: int, not_before: float) -> None:
+        with self.transaction():
+            self.connection.execute(
+                "UPDATE outbox SET attempts = ?, not_before = ? WHERE id = ?", (attempts, not_before, id)
+            )
+
+    def migrate_json_state(self, game_domain_name: str, seen_mods_file: str, update_cache_file: str) -> None:
+        # Import the state files of previous versions once, the files themselves are left untouched
+        if not self.seen_mods(game_domain_name) and (seen_mods := load_state(seen_mods_file)):
+            print(f"[{game_domain_name}] Importing {seen_mods_file}...")
+            self.add_seen_mods(game_domain_name, seen_mods)
+
+        if not self.tracked_mods(game_domain_name) and (update_cache := load_state(update_cache_file)):
+            print(f"[{game_domain_name}] Importing {update_cache_file}...")
+            self.save_tracked_mods(
+                game_domain_name,
+                {
+                    int(mod_id): TrackedModState(
+                        mod.get("version"), mod.get("latest_file_update"), bool(mod.get("is_adult"))
+                    )
+                    for mod_id, mod in update_cache.items()
+                },
+            )
+
+        if not self.categories(game_domain_name) and (categories := load_state("game_categories.json")):
+            print("Importing game_categories.json...")
+            self.save_categories(
+                {
+                    game: {int(id): Category(int(id), name) for id, name in values.items()}
+                    for game, values in categories.items()
+                }
+            )
+
+
+class RateLimiter:
+    def __init__(self, rate: float = 5, burst: int = 10, reserve: int = 10) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.reserve = reserve
+        self.tokens = float(burst)
+        self.last_refill = time.monotonic()
+        # Callers waiting for their turn, by priority and then in FIFO order
+        self.waiting: list[tuple[float, int, asyncio.Future[None]]] = []
+        self.sequence = itertools.count()
+        self.busy = False
+
+        self.hourly_limit: int | None = None
+        self.hourly_remaining: int | None = None
+        self.hourly_reset: datetime | None = None
+        self.daily_limit: int | None = None
+        self.daily_remaining: int | None = None
+        self.daily_reset: datetime | None = None
+
+    @property
+    def budget(self) -> dict[str, Any]:
+        return {
+            "tokens": round(self.tokens, 2),
+            "hourly_remaining": self.hourly_remaining,
+            "hourly_limit": self.hourly_limit,
+            "hourly_reset": self.hourly_reset,
+            "daily_remaining": self.daily_remaining,
+            "daily_limit": self.daily_limit,
+            "daily_reset": self.daily_reset,
+        }
+
+    def __str__(self) -> str:
+        return f"hourly {self.hourly_remaining}/{self.hourly_limit}, daily {self.daily_remaining}/{self.daily_limit}"
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def _quota_wait(self) -> float:
+        # Nexus keeps answering as long as either the daily or the hourly quota has requests left
+        if self.hourly_remaining is None or self.daily_remaining is None:
+            return 0
+        if self.hourly_remaining > self.reserve or self.daily_remaining > self.reserve:
+            return 0
+
+        resets = [reset for reset in (self.hourly_reset, self.daily_reset) if reset]
+        if not resets:
+            return 60
+        return max(1.0, (min(resets) - datetime.now(timezone.utc)).total_seconds())
+
+    def _next(self) -> None:
+        self.busy = False
+        while self.waiting:
+            _, _, future = heapq.heappop(self.waiting)
+            if not future.done():
+                self.busy = True
+                future.set_result(None)
+                return
+
+    async def acquire(self) -> None:
+        if self.busy or self.waiting:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self.waiting, (-request_priority.get(), next(self.sequence), future))
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self._next()
+                raise
+        self.busy = True
+
+        try:
+            if wait := self._quota_wait():
+                print(f"API quota low ({self}), queuing requests for {wait:.0f}s...")
+                await asyncio.sleep(wait)
+                self.hourly_remaining = self.daily_remaining = None
+
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+        finally:
+            self._next()
+
+    def update(self, response: ClientResponse) -> None:
+        headers = response.headers
+        for period in ("hourly", "daily"):
+            if (limit := headers.get(f"X-RL-{period.capitalize()}-Limit")) is not None:
+                setattr(self, f"{period}_limit", int(limit))
+            if (remaining := headers.get(f"X-RL-{period.capitalize()}-Remaining")) is not None:
+                setattr(self, f"{period}_remaining", int(remaining))
+            if reset := headers.get(f"X-RL-{period.capitalize()}-Reset"):
+                try:
+                    setattr(self, f"{period}_reset", datetime.fromisoformat(reset))
+                except ValueError:
+                    pass
+
+        if response.status == 429:
+            self.hourly_remaining = self.daily_remaining = 0
+
+
+class ResponseCache:
+    def __init__(self, store: StateStore) -> None:
+        self.store = store
+        # Bodies are only decoded once per process, unchanged responses are served from here. Other workers share the
+        # table, so the validators a body was decoded for are kept to notice when one of them stored a newer body.
+        self.decoded: dict[str, tuple[str | None, str | None, Any]] = {}
+
+    @staticmethod
+    def key(url: str, params: dict[str, Any] | None = None) -> str:
+        return url + ("?" + "&".join(f"{key}={value}" for key, value in sorted(params.items())) if params else "")
+
+    def validators(self, key: str) -> dict[str, str]:
+        headers = {}
+        if validators := self.store.http_cache_validators(key):
+            etag, last_modified = validators
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def get(self, key: str, decode: Callable[[bytes], Any] = json_loads) -> Any:
+        validators = self.store.http_cache_validators(key)
+        if (decoded := self.decoded.get(key)) and decoded[:2] == validators:
+            return decoded[2]
+        if not (entry := self.store.http_cache_entry(key)):
+            return None
+        validators = (entry["etag"], entry["last_modified"])
+        body = entry["body"]
+        data = decode(body.encode() if isinstance(body, str) else body) if body else None
+        self.decoded[key] = (*validators, data)
+        return data
+
+    def store_response(self, key: str, response: ClientResponse, body: bytes, data: Any) -> None:
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if not etag and not last_modified:
+            return
+
+        self.store.save_http_cache_entry(key, etag, last_modified, body)
+        self.decoded[key] = (etag, last_modified, data)
+
+
+class ModImageParser(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__()
+        self.urls: list[str] = []
+        self.done = False
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        if tag != "a" or self.done:
+            return
+        attributes = dict(attrs)
+        if "mod-image" in (attributes.get("class") or "").split() and (href := attributes.get("href")):
+            self.urls.append(href)
+
+    def handle_endtag(self, tag: str) -> None:
+        # All images are inside a single gallery list, once it is closed there is nothing left to find
+        if tag == "ul" and self.urls:
+            self.done = True
+
 
 class NM:
-    def __init__(self, api_key: str, session: ClientSession) -> None:
+    api_url = "https://api.nexusmods.com/v1"
+    web_url = "https://www.nexusmods.com"
+
+    def __init__(
+        self,
+        api_key: str,
+        session: ClientSession,
+        rate_limiter: RateLimiter | None = None,
+        store: StateStore | None = None,
+        image_urls_ttl: float = 6 * 60 * 60,
+        categories_ttl: float = 7 * 24 * 60 * 60,
+        web_session: ClientSession | None = None,
+        retries: int = 2,
+    ) -> None:
         self.api_key = api_key
         self.session = session
+        # Mod pages are scraped through their own connection pool, so slow pages can't hold up API requests
+        self.web_session = web_session or session
+        self.retries = retries
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.store = store
+        metrics.gauge(
+            "nexus_quota_remaining",
+            "Remaining Nexus Mods API quota",
+            lambda: {
+                (("period", period),): remaining
+                for period, remaining in (
+                    ("hourly", self.rate_limiter.hourly_remaining),
+                    ("daily", self.rate_limiter.daily_remaining),
+                )
+                if remaining is not None
+            },
+        )
+        self.response_cache = ResponseCache(store) if store else None
+        self.categories: dict[str, dict[int, Category]] = {}
+        self.categories_ttl = categories_ttl
+        self.categories_refreshed: dict[str, float] = {}
+        self.categories_refreshing: dict[str, asyncio.Task[None]] = {}
+        self.inflight: dict[str, asyncio.Future[Any]] = {}
+        self.recent: dict[str, tuple[float, Any]] = {}
+        self.image_urls: OrderedDict[tuple[str, int], tuple[float, list[str]]] = OrderedDict()
+        self.image_urls_ttl = image_urls_ttl
+        self.image_urls_size = 1000
+
+    async def _nm_request(
+        self,
+        endpoint: str,
+        params: dict[str, Any] | None = None,
+        cache: bool = False,
+        max_age: float = 0,
+        decode: Callable[[bytes], Any] = json_loads,
+    ) -> Any:
+        url = f"{self.api_url}/{endpoint}"
+        cache_key = ResponseCache.key(url, params)
+
+        # Share a response that was received just now, eg. the tracked mods with the update checks of all games
+        if max_age and (recent := self.recent.get(cache_key)) and recent[0] > time.monotonic() - max_age:
+            metrics.inc("nexus_requests_shared_total", "Nexus Mods API requests served by another caller")
+            return recent[1]
+
+        # Identical requests in flight at the same time are only sent once
+        if (future := self.inflight.get(cache_key)) is None:
+            future = self.inflight[cache_key] = asyncio.ensure_future(
+                self._nm_fetch(endpoint, url, params, cache, decode)
+            )
+            future.add_done_callback(lambda _: self.inflight.pop(cache_key, None))
+        else:
+            metrics.inc("nexus_requests_shared_total", "Nexus Mods API requests served by another caller")
 
-    async def _nm_request(self, endpoint: str, params: dict[str, Any] | None = None) -> Any:
+        data = await asyncio.shield(future)
+        if max_age:
+            self.recent[cache_key] = (time.monotonic(), data)
+        return data
+
+    async def _nm_fetch(
+        self, endpoint: str, url: str, params: dict[str, Any] | None, cache: bool, decode: Callable[[bytes], Any]
+    ) -> Any:
         headers = {
             "apikey": self.api_key,
             "User-Agent": "NexusMods Notifier/0.2.0 (+https://github.com/Nachtalb/nexusmods-notifier)",
         }
-        url = f"https://api.nexusmods.com/v1/{endpoint}"
-        async with self.session.get(url, headers=headers, params=params) as response:
-            return await response.json()
+        cache_key = ResponseCache.key(url, params)
+        if cache and self.response_cache:
+            headers.update(self.response_cache.validators(cache_key))
+
+        endpoint_label = ID_PATTERN.sub("/{id}", endpoint)
+        failures = 0
+        while True:
+            await self.rate_limiter.acquire()
+            try:
+                with metrics.time(
+                    "nexus_request_duration_seconds", "Duration of Nexus Mods API requests", endpoint=endpoint_label
+                ):
+                    async with self.session.get(url, headers=headers, params=params) as response:
+                        metrics.inc(
+                            "nexus_requests_total",
+                            "Nexus Mods API requests",
+                            endpoint=endpoint_label,
+                            status=response.status,
+                        )
+                        self.rate_limiter.update(response)
+                        if response.status == 429:
+                            # Quota ran out after all (eg. used by another client), the limiter waits for the reset
+                            continue
+                        if cache and self.response_cache and response.status == 304:
+                            return self.response_cache.get(cache_key, decode)
+                        body = await response.read()
+                        data = decode(body)
+                        if cache and self.response_cache and response.status == 200:
+                            self.response_cache.store_response(cache_key, response, body, data)
+                        return data
+            except (asyncio.TimeoutError, ClientError) as e:
+                # Timed out or dropped connections are retried a few times before the whole check fails
+                metrics.inc("nexus_requests_total", "Nexus Mods API requests", endpoint=endpoint_label, status="error")
+                failures += 1
+                if failures > self.retries:
+                    raise
+                print(f"Request to {endpoint} failed ({e!r}), retrying...")
 
     async def fetch_games(self) -> list[dict[str, Any]]:
         return await self._nm_request("games.json", {"include_unapproved": "false"})  # type: ignore[no-any-return]
 
-    async def game_categories(self, game_domain_name: str) -> dict[int, Any]:
-        cache_file = Path("game_categories.json")
-        if (cache := load_state(cache_file)) and game_domain_name in cache:
-            return {int(id): value for id, value in cache[game_domain_name].items()}
-
-        games = await self.fetch_games()
-        cache = {
-            game["domain_name"]: {category["category_id"]: category["name"] for category in game["categories"]}
-            for game in games
+    async def fetch_game(self, game_domain_name: str) -> dict[str, Any]:
+        return await self._nm_request(f"games/{game_domain_name}.json")  # type: ignore[no-any-return]
+
+    async def game_categories(self, game_domain_name: str) -> dict[int, Category]:
+        if game_domain_name in self.categories:
+            return self.categories[game_domain_name]
+
+        if self.store and (categories := self.store.categories(game_domain_name)):
+            self.categories[game_domain_name] = categories
+            # Refreshes are recorded like a feed run, stale categories are used until the refresh is done
+            self.categories_refreshed[game_domain_name] = self.store.last_run(game_domain_name, "categories") or 0
+            self.refresh_categories(game_domain_name, min_age=self.categories_ttl)
+            return categories
+
+        await self._refresh_categories(game_domain_name)
+        return self.categories[game_domain_name]
+
+    def category(self, game_domain_name: str, category_id: int) -> Category:
+        if category := self.categories.get(game_domain_name, {}).get(category_id):
+            # Long running feeds pick up renamed categories once the TTL is over
+            self.refresh_categories(game_domain_name, min_age=self.categories_ttl)
+            return category
+        # A category was added since the last refresh, show it once the refreshed list is in
+        self.refresh_categories(game_domain_name, min_age=10 * 60)
+        return Category(category_id, "N/A")
+
+    def refresh_categories(self, game_domain_name: str, min_age: float = 0) -> None:
+        if game_domain_name in self.categories_refreshing:
+            return
+        if time.time() - self.categories_refreshed.get(game_domain_name, 0) < min_age:
+            return
+
+        async def refresh() -> None:
+            try:
+                await self._refresh_categories(game_domain_name)
+            except Exception as e:
+                print(f"[{game_domain_name}] Could not refresh categories: {e}")
+            finally:
+                del self.categories_refreshing[game_domain_name]
+
+        self.categories_refreshing[game_domain_name] = asyncio.create_task(refresh())
+
+    async def _refresh_categories(self, game_domain_name: str) -> None:
+        self.categories_refreshed[game_domain_name] = time.time()
+        game = await self.fetch_game(game_domain_name)
+        categories = {
+            category["category_id"]: Category(category["category_id"], category["name"])
+            for category in game["categories"]
         }
-        save_state(cache_file, cache)
-        return cache[game_domain_name]  # type: ignore[no-any-return]
+        # Updated in place, so every feed that holds on to the categories of a game sees the new ones
+        self.categories.setdefault(game_domain_name, {}).update(categories)
+        if self.store:
+            self.store.save_categories({game_domain_name: categories})
+            self.store.save_last_run(game_domain_name, "categories", time.time())
 
     async def fetch_latest_mods(self, game_domain_name: str) -> list[dict[str, Any]]:
-        return await self._nm_request(f"games/{game_domain_name}/mods/latest_added.json")  # type: ignore[no-any-return]
+        return await self._nm_request(  # type: ignore[no-any-return]
+            f"games/{game_domain_name}/mods/latest_added.json", cache=True
+        )
 
-    async def fetch_tracked_mods(self, game_domain_name: str = "") -> list[dict[str, Any]]:
-        mods: list[dict[str, Any]] = await self._nm_request("user/tracked_mods.json")
-        if game_domain_name:
-            mods = [mod for mod in mods if mod["domain_name"] == game_domain_name]
-        return mods
+    async def fetch_tracked_mods(self, game_domain_name: str) -> list[tuple[int, bool]]:
+        # Decoded once into (mod_id, is_adult) per game, as long as the response is unchanged the same list is returned
+        games: dict[str, list[tuple[int, bool]]] = await self._nm_request(
+            "user/tracked_mods.json", cache=True, max_age=60, decode=tracked_mods_by_game
+        )
+        return games.get(game_domain_name, [])
 
     async def fetch_mod(self, game_domain_name: str, mod_id: int) -> dict[str, Any]:
         return await self._nm_request(f"games/{game_domain_name}/mods/{mod_id}.json")  # type: ignore[no-any-return]
 
     async def fetch_updated_mods(
         self, game_domain_name: str, time_period: Literal["1d", "1w", "1m"] = "1w"
-    ) -> list[dict[str, Any]]:
+    ) -> dict[int, int]:
         return await self._nm_request(  # type: ignore[no-any-return]
             f"games/{game_domain_name}/mods/updated.json",
             params={"period": time_period},
+            cache=True,
+            decode=mod_update_times,
         )
 
     async def fetch_mod_changelogs(self, game_domain_name: str, mod_id: int) -> dict[str, list[str]]:
         return await self._nm_request(f"games/{game_domain_name}/mods/{mod_id}/changelogs.json")  # type: ignore[no-any-return]
 
-    async def get_image_urls(self, mod_id: int) -> list[str]:
-        async with self.session.get(f"https://www.nexusmods.com/starfield/mods/{mod_id}?tab=images") as response:
-            soup = BeautifulSoup(await response.text(), "html.parser")
-            return [a.attrs["href"] for a in soup.find_all("a", {"class": "mod-image"})]
+    async def get_image_urls(self, game_domain_name: str, mod_id: int) -> list[str]:
+        key = (game_domain_name, mod_id)
+        if (cached := self.image_urls.get(key)) and cached[0] > time.monotonic():
+            metrics.inc("image_url_cache_total", "Image URL cache lookups", result="hit")
+            self.image_urls.move_to_end(key)
+            return cached[1]
+        metrics.inc("image_url_cache_total", "Image URL cache lookups", result="miss")
+
+        parser = ModImageParser()
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        url = f"{self.web_url}/{game_domain_name}/mods/{mod_id}?tab=images"
+        try:
+            with metrics.time("nexus_page_request_duration_seconds", "Duration of scraping Nexus Mods mod pages"):
+                async with self.web_session.get(url) as response:
+                    # Stop reading the page as soon as the image gallery has been parsed
+                    async for chunk in response.content.iter_chunked(64 * 1024):
+                        parser.feed(decoder.decode(chunk))
+                        if parser.done:
+                            break
+        except (asyncio.TimeoutError, ClientError) as e:
+            # The images are optional, the mod is posted without them and the page is tried again next time
+            print(f"Could not load images of mod [id={mod_id}]: {e!r}")
+            return []
+
+        self.image_urls[key] = (time.monotonic() + self.image_urls_ttl, parser.urls)
+        self.image_urls.move_to_end(key)
+        while len(self.image_urls) > self.image_urls_size:
+            self.image_urls.popitem(last=False)
+        return parser.urls
 
 
 class TG:
-    def __init__(self, session: ClientSession, tg_token: str) -> None:
+    api_url = "https://api.telegram.org"
+
+    def __init__(self, session: ClientSession, tg_token: str, file_ids_size: int = 1000) -> None:
         self.session = session
         self.tg_token = tg_token
+        # Telegram's file IDs of already sent images, so the same image is not downloaded again for every chat
+        self.file_ids: OrderedDict[str, str] = OrderedDict()
+        self.file_ids_size = file_ids_size
 
     async def _tg_request(self, endpoint: str, data: dict[str, Any] | None = None) -> dict[str, Any]:
         if data:
             data = {key: value for key, value in data.items() if value is not None}
-        url = f"https://api.telegram.org/bot{self.tg_token}/{endpoint}"
-        async with self.session.post(url, json=data) as response:
-            return await response.json()  # type: ignore[no-any-return]
+        url = f"{self.api_url}/bot{self.tg_token}/{endpoint}"
+        with metrics.time("telegram_request_duration_seconds", "Duration of Telegram API requests", method=endpoint):
+            async with self.session.post(url, json=data) as response:
+                result: dict[str, Any] = await response.json()
+        metrics.inc("telegram_requests_total", "Telegram API requests", method=endpoint, ok=result.get("ok"))
+        return result
 
     async def send_message(
         self, chat_id: int | str, text: str, topic_id: int | str | None = None, disable_web_page_preview: bool = False
@@ -98,7 +929,15 @@ class TG:
     async def send_media_group(
         self, chat_id: int | str, media: list[str], text: str | None = None, topic_id: int | str | None = None
     ) -> dict[str, Any]:
-        photos = [{"type": "photo", "media": photo} for photo in media]
+        cached = [url for url in media if url in self.file_ids]
+        metrics.inc("telegram_file_id_cache_total", "Telegram file ID cache lookups", len(cached), result="hit")
+        metrics.inc(
+            "telegram_file_id_cache_total", "Telegram file ID cache lookups", len(media) - len(cached), result="miss"
+        )
+        for url in cached:
+            self.file_ids.move_to_end(url)
+
+        photos = [{"type": "photo", "media": self.file_ids.get(photo, photo)} for photo in media]
         if text:
             photos[0]["caption"] = text
             photos[0]["parse_mode"] = "HTML"
@@ -106,7 +945,23 @@ class TG:
         data = {"chat_id": chat_id, "media": photos}
         if topic_id:
             data["message_thread_id"] = topic_id
-        return await self._tg_request("sendMediaGroup", data=data)
+        response = await self._tg_request("sendMediaGroup", data=data)
+
+        if response["ok"]:
+            # The messages are returned in the order of the media, the last size of a photo is the original one
+            for url, message in zip(media, response["result"]):
+                if message.get("photo"):
+                    self.file_ids[url] = message["photo"][-1]["file_id"]
+                    self.file_ids.move_to_end(url)
+            while len(self.file_ids) > self.file_ids_size:
+                self.file_ids.popitem(last=False)
+        elif cached and response.get("error_code") == 400:
+            # A file ID may no longer be accepted, send the images from their URLs again
+            print(f"Could not send cached images, retrying with their URLs: {response['description']}")
+            for url in cached:
+                del self.file_ids[url]
+            return await self.send_media_group(chat_id, media, text, topic_id)
+        return response
 
     async def send_mod(
         self,
@@ -122,29 +977,23 @@ class TG:
         images: list[str] = [],
         topic_id: str | int | None = None,
     ) -> dict[str, Any]:
-        link = f"https://nexusmods.com/{mod_game}/mods/{mod_id}"
-        title = f'<b><a href="{link}">{mod_title}</a></b>'
-        category = tagify(mod_category)
-        version = f"Version {mod_old_version} -> {mod_new_version}\n" if mod_new_version else ""
+        card = (mod_title, mod_id, mod_author, mod_game, mod_category, mod_old_version, mod_new_version, content)
         images = images[:10]
-        content = content.replace("<br />", "\n").replace("\n\n", "\n")
-        content = f"{content.strip()}\n\n" if content else ""
-
-        text = f"{title}\n{mod_author} {category}\n{version}\n{content}<a href='{link}'>View on Nexus</a>"
 
         response = None
         if images:
             response = await self.send_media_group(
                 chat_id=chat_id,
                 media=images,
-                text=text,
+                text=render_mod(*card, limit=CAPTION_LIMIT),
                 topic_id=topic_id,
             )
 
-        if not response or not response["ok"]:
+        # A flood limit also applies to the fallback message, so leave the retry to the caller
+        if not response or (not response["ok"] and response.get("error_code") != 429):
             response = await self.send_message(
                 chat_id=chat_id,
-                text=text,
+                text=render_mod(*card, limit=MESSAGE_LIMIT),
                 topic_id=topic_id,
             )
 
@@ -154,6 +1003,333 @@ class TG:
         return response
 
 
+@dataclass
+class Subscriber:
+    chat_id: str
+    topic_id: str = ""
+    hide_adult_content: bool = False
+
+
+@dataclass
+class Job:
+    name: str
+    interval: float
+    run: Callable[..., Awaitable[int]]
+    trigger: asyncio.Event = field(default_factory=asyncio.Event)
+    activity: float = 0.0
+    # Decayed sums of the mods found by polling and of the time they were found in, starting from one mod per interval
+    found: float = 1.0
+    elapsed: float = 0.0
+    polled: float | None = None
+
+    @property
+    def rate(self) -> float:
+        return self.found / self.elapsed
+
+    def learn(self, found: int, elapsed: float, decay: float = 0.8) -> None:
+        self.found = decay * self.found + found
+        self.elapsed = decay * self.elapsed + elapsed
+
+
+class Scheduler:
+    def __init__(self, jitter: float = 0.1, budget: float = 0, bounds: tuple[float, float] = (60, 3600)) -> None:
+        self.jitter = jitter
+        # With a budget (checks per hour) the intervals follow the rate at which each feed finds mods
+        self.budget = budget
+        self.bounds = bounds
+        self.jobs: list[Job] = []
+        self.pushes: set[asyncio.Task[int]] = set()
+        self.stopping = False
+        metrics.gauge(
+            "check_activity",
+            "Moving average of mods found per check, used as request priority",
+            lambda: {(("job", job.name),): job.activity for job in self.jobs},
+        )
+        metrics.gauge(
+            "check_interval_seconds",
+            "Interval between checks",
+            lambda: {(("job", job.name),): job.interval for job in self.jobs},
+        )
+
+    def add(self, name: str, interval: float, run: Callable[..., Awaitable[int]]) -> None:
+        self.jobs.append(Job(name, interval, run, elapsed=interval))
+        if self.budget:
+            self._adapt()
+
+    def _adapt(self) -> None:
+        for job, interval in zip(
+            self.jobs, allocate_intervals([job.rate for job in self.jobs], self.budget, self.bounds)
+        ):
+            job.interval = interval
+
+    def run_now(self) -> None:
+        print("Running all checks now...")
+        for job in self.jobs:
+            job.trigger.set()
+
+    def stop(self) -> None:
+        # Running checks are finished, no new ones are started
+        self.stopping = True
+        for job in self.jobs:
+            job.trigger.set()
+
+    async def _run_job(self, job: Job) -> None:
+        while not self.stopping:
+            job.trigger.clear()
+            started = time.monotonic()
+            found = await self._run(job)
+            if self.stopping:
+                break
+            # The first check also finds what was missed while the notifier wasn't running, so it isn't learned from
+            if job.polled is not None:
+                job.learn(found, started - job.polled)
+            job.polled = started
+            if self.budget:
+                self._adapt()
+
+            # A job never overlaps with itself: if a run takes longer than its interval, or "run now" is triggered
+            # while it runs, the missed runs are coalesced into a single one that starts right away.
+            interval = job.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+            delay = max(0.0, interval - (time.monotonic() - started))
+            print(f"[{job.name}] Next check in {delay / 60:.1f} minute/s...")
+            try:
+                await asyncio.wait_for(job.trigger.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run(self, job: Job, pushed: list[dict[str, Any]] | None = None) -> int:
+        # Jobs that recently found something get their Nexus requests served first when the quota runs short.
+        request_priority.set(job.activity)
+        with metrics.time("check_duration_seconds", "Duration of a check cycle", job=job.name):
+            found = await (job.run() if pushed is None else job.run(pushed))
+        job.activity = 0.7 * job.activity + 0.3 * found
+        return found
+
+    def push(self, name: str, events: list[dict[str, Any]]) -> bool:
+        if not (job := next((job for job in self.jobs if job.name == name), None)):
+            return False
+        metrics.inc("pushed_events_total", "Mod events received through the ingest endpoint", len(events), job=name)
+        task = asyncio.create_task(self._run(job, events))
+        self.pushes.add(task)
+        task.add_done_callback(self.pushes.discard)
+        return True
+
+    async def serve(self, port: int, token: str = "", host: str = "127.0.0.1") -> web.AppRunner:
+        # Mod events pushed by a relay or another instance, in the shape of the latest added / updated mods lists
+        async def handle(request: web.Request) -> web.Response:
+            if token and request.headers.get("Authorization") != f"Bearer {token}":
+                return web.json_response({"error": "Unauthorized"}, status=401)
+            try:
+                events = await request.json()
+            except ValueError:
+                events = None
+            if not isinstance(events, list) or not all(isinstance(event, dict) for event in events):
+                return web.json_response({"error": "Expected a list of mods"}, status=400)
+            fields = PUSHED_EVENT_FIELDS.get(request.match_info["feed"], {})
+            for event in events:
+                # bool is a subclass of int, so it is ruled out explicitly for the integer fields
+                invalid = [
+                    key
+                    for key, type in fields.items()
+                    if not isinstance(event.get(key), type) or (type is int and isinstance(event[key], bool))
+                ]
+                if invalid:
+                    return web.json_response({"error": f"Missing or invalid fields: {', '.join(invalid)}"}, status=400)
+
+            if self.stopping:
+                return web.json_response({"error": "Shutting down"}, status=503)
+            name = f"{request.match_info['game']}/{request.match_info['feed']}"
+            if not self.push(name, events):
+                return web.json_response({"error": f"No subscription for {name}"}, status=404)
+            return web.json_response({"accepted": len(events)}, status=202)
+
+        app = web.Application()
+        app.router.add_post("/{game}/{feed}", handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host=host, port=port).start()
+        print(f"Accepting pushed mod events on {host}:{port}")
+        return runner
+
+    async def run_once(self) -> None:
+        await asyncio.gather(*(self._run(job) for job in self.jobs))
+
+    async def run(self) -> None:
+        with suppress(NotImplementedError):
+            asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, self.run_now)
+        await asyncio.gather(*(self._run_job(job) for job in self.jobs))
+        # Pushed events that are being handled are part of the running checks
+        await asyncio.gather(*self.pushes)
+
+
+class DeliveryQueue:
+    def __init__(
+        self,
+        tg: TG,
+        store: StateStore,
+        global_rate: float = 25,
+        max_attempts: int = 5,
+        digest_threshold: int = 10,
+        deliver: bool = True,
+    ) -> None:
+        self.tg = tg
+        self.store = store
+        # Worker processes only add to the outbox, their messages are sent by the supervisor
+        self.deliver = deliver
+        self.max_attempts = max_attempts
+        self.digest_threshold = digest_threshold
+        self.rate_limiter = RateLimiter(rate=global_rate, burst=int(global_rate))
+        self.workers: dict[str, asyncio.Task[None]] = {}
+        self.stopping = asyncio.Event()
+        metrics.gauge(
+            "delivery_queue_depth", "Messages waiting to be sent", lambda: {(): self.store.pending_deliveries()}
+        )
+
+    @staticmethod
+    def chat_interval(chat_id: str) -> float:
+        # Telegram allows about one message per second in private chats and 20 messages per minute in groups
+        return 3.0 if chat_id.startswith("-") else 1.0
+
+    def send_mod(self, **kwargs: Any) -> None:
+        self._enqueue("send_mod", kwargs)
+
+    def send_message(self, **kwargs: Any) -> None:
+        self._enqueue("send_message", kwargs)
+
+    def _enqueue(self, method: str, kwargs: dict[str, Any]) -> None:
+        chat_id = str(kwargs["chat_id"])
+        self.store.enqueue_delivery(chat_id, method, kwargs)
+        metrics.inc("deliveries_queued_total", "Messages added to the delivery queue", method=method)
+        self._start_worker(chat_id)
+
+    def _start_worker(self, chat_id: str) -> bool:
+        if not self.deliver or self.stopping.is_set() or (chat_id in self.workers and not self.workers[chat_id].done()):
+            return False
+        self.workers[chat_id] = asyncio.create_task(self._worker(chat_id))
+        return True
+
+    def resume(self) -> None:
+        for chat_id in self.store.delivery_chats():
+            if self._start_worker(chat_id):
+                print(f"Resuming pending deliveries for chat {chat_id}...")
+
+    async def drain(self) -> None:
+        while workers := [worker for worker in self.workers.values() if not worker.done()]:
+            await asyncio.gather(*workers)
+
+    def stop(self) -> None:
+        # Messages being sent are finished, the others stay in the outbox until the next start
+        self.stopping.set()
+
+    async def _sleep(self, delay: float) -> None:
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self.stopping.wait(), delay)
+
+    def sends_digest(self, mods: int) -> bool:
+        # Whether this many mods for a chat are sent as a digest instead of one post each
+        return 0 < self.digest_threshold <= mods
+
+    def sends_digests(self, subscribers: list[Subscriber], is_adult: list[bool]) -> bool:
+        return all(
+            self.sends_digest(sum(1 for adult in is_adult if not subscriber.hide_adult_content or not adult))
+            for subscriber in subscribers
+        )
+
+    def _digest(self, chat_id: str) -> bool:
+        if not self.sends_digest(self.store.count_deliveries(chat_id, "send_mod")):
+            return False
+
+        deliveries = self.store.deliveries(chat_id, "send_mod")
+        sections: dict[tuple[str, str], list[str]] = defaultdict(list)
+        for delivery in deliveries:
+            mod = delivery["payload"]
+            link = f"https://nexusmods.com/{mod['mod_game']}/mods/{mod['mod_id']}"
+            line = f'<a href="{link}">{mod["mod_title"]}</a> - {mod["mod_author"]}'
+            if mod.get("mod_new_version"):
+                line += f" ({mod.get('mod_old_version') or 'N/A'} -> {mod['mod_new_version']})"
+                sections[(mod.get("topic_id") or "", "Updated mods:")].append(line)
+            else:
+                sections[(mod.get("topic_id") or "", "New mods found:")].append(line)
+
+        messages = []
+        for (topic_id, header), lines in sections.items():
+            text = header
+            for line in lines:
+                # Telegram messages are limited to 4096 characters
+                if len(text) + len(line) + 1 > 4096:
+                    messages.append({"chat_id": chat_id, "text": text, "topic_id": topic_id})
+                    text = header
+                text += "\n" + line
+            messages.append({"chat_id": chat_id, "text": text, "topic_id": topic_id})
+
+        print(f"Sending {len(deliveries)} mods to chat {chat_id} as {len(messages)} digest message/s...")
+        self.store.replace_deliveries(
+            [delivery["id"] for delivery in deliveries],
+            chat_id,
+            "send_message",
+            [{**message, "disable_web_page_preview": True} for message in messages],
+        )
+        metrics.inc("deliveries_total", "Processed deliveries", len(deliveries), result="digested")
+        return True
+
+    async def _worker(self, chat_id: str) -> None:
+        # One worker per chat, so messages to a chat are sent in order and paced independently of other chats
+        while not self.stopping.is_set() and (delivery := self.store.next_delivery(chat_id)):
+            # During release waves the waiting mods are combined into a few digest messages
+            if delivery["method"] == "send_mod" and self._digest(chat_id):
+                continue
+            if (delay := delivery["not_before"] - time.time()) > 0:
+                await self._sleep(delay)
+            await self.rate_limiter.acquire()
+            if self.stopping.is_set():
+                break
+
+            try:
+                response = await getattr(self.tg, delivery["method"])(**delivery["payload"])
+            except Exception as e:
+                response = {"ok": False, "description": str(e)}
+
+            attempts = delivery["attempts"] + 1
+            error_code = response.get("error_code", 0)
+            if response["ok"]:
+                metrics.inc("deliveries_total", "Processed deliveries", result="sent")
+                self.store.delete_delivery(delivery["id"])
+            elif retry_after := response.get("parameters", {}).get("retry_after"):
+                print(f"Rate limited by Telegram in chat {chat_id}, retrying in {retry_after}s...")
+                metrics.inc("deliveries_total", "Processed deliveries", result="rate_limited")
+                self.store.retry_delivery(delivery["id"], delivery["attempts"], time.time() + retry_after)
+                continue
+            elif attempts >= self.max_attempts or 400 <= error_code < 500:
+                print(f"Dropping message for chat {chat_id} after {attempts} attempt/s: {response['description']}")
+                metrics.inc("deliveries_total", "Processed deliveries", result="dropped")
+                self.store.delete_delivery(delivery["id"])
+            else:
+                metrics.inc("deliveries_total", "Processed deliveries", result="retried")
+                self.store.retry_delivery(delivery["id"], attempts, time.time() + 5 * 2**attempts)
+
+            await self._sleep(self.chat_interval(chat_id))
+
+
+def client_session(
+    connections: int = 8,
+    timeout: float = 30,
+    connect_timeout: float = 10,
+    total_timeout: float = 120,
+    keepalive: float = 30,
+    dns_ttl: int = 300,
+) -> ClientSession:
+    # Each session talks to a single host, so its connection limit is the limit for that host
+    connector = TCPConnector(
+        limit=connections, limit_per_host=connections, keepalive_timeout=keepalive, ttl_dns_cache=dns_ttl
+    )
+    # A hanging response fails after `timeout` seconds without data, and one trickling in slowly after `total_timeout`,
+    # instead of stalling a whole check
+    return ClientSession(
+        connector=connector,
+        timeout=ClientTimeout(total=total_timeout, sock_connect=connect_timeout, sock_read=timeout),
+    )
+
+
 def load_state(state_file: str | Path) -> Any:
     state_file = Path(state_file)
     if state_file.is_file():
@@ -164,252 +1340,706 @@ def save_state(state_file: str | Path, seen_mods: Any) -> None:
     Path(state_file).write_text(json.dumps(seen_mods))
 
 
+@lru_cache(maxsize=1024)
 def tagify(text: str) -> str:
-    return "#" + re.sub(r"[ -/]", "_", re.sub(r",", "", text)).lower()
+    return "#" + TAG_SEPARATOR_PATTERN.sub("_", text.replace(",", "")).lower()
+
+
+def truncate(text: str, limit: int) -> str:
+    if len(text) <= limit:
+        return text
+    end = limit - 1
+    while end > 0:
+        # Cut at a line break or space, but never inside a tag or entity
+        cut = text.rfind("\n", 0, end)
+        if cut < end // 2:
+            cut = text.rfind(" ", 0, end)
+        if cut <= 0:
+            cut = end
+        head = PARTIAL_MARKUP_PATTERN.sub("", text[:cut])
+
+        # Telegram rejects messages with unclosed tags, so the tags left open by the cut are closed again
+        open_tags: list[str] = []
+        for closing, name, self_closing in TAG_PATTERN.findall(head):
+            if closing and name in open_tags:
+                del open_tags[len(open_tags) - 1 - open_tags[::-1].index(name) :]
+            elif not closing and not self_closing:
+                open_tags.append(name)
+        truncated = head + "…" + "".join(f"</{name}>" for name in reversed(open_tags))
+        if len(truncated) <= limit:
+            return truncated
+        end -= len(truncated) - limit
+    return "…"
+
+
+@lru_cache(maxsize=256)
+def render_mod(
+    mod_title: str,
+    mod_id: str | int,
+    mod_author: str,
+    mod_game: str,
+    mod_category: str,
+    mod_old_version: str = "",
+    mod_new_version: str = "",
+    content: str = "",
+    limit: int = MESSAGE_LIMIT,
+) -> str:
+    # Cached, so the same card sent to many chats or retried is only rendered once
+    link = f"https://nexusmods.com/{mod_game}/mods/{mod_id}"
+    version = f"Version {mod_old_version} -> {mod_new_version}\n" if mod_new_version else ""
+    details = f"\n{mod_author} {tagify(mod_category)}\n{version}\n"
+    tail = f"<a href='{link}'>View on Nexus</a>"
+
+    # The content is shortened to fit, and the title too if it doesn't fit on its own. The text is counted with its
+    # markup, so it never ends up too long.
+    title_limit = limit - len(f'<b><a href="{link}"></a></b>') - len(details) - len(tail)
+    head = f'<b><a href="{link}">{truncate(mod_title, max(title_limit, 1))}</a></b>' + details
+    content = LINE_BREAK_PATTERN.sub("\n", content).strip()
+    if content and (content_limit := limit - len(head) - len(tail) - 2) > 0:
+        content = truncate(content, content_limit) + "\n\n"
+    else:
+        content = ""
+    # Only reached by an absurdly long author, category or version
+    return truncate(head + content + tail, limit)
+
+
+def render_changelog(versions: dict[str, list[str]]) -> str:
+    if not versions:
+        return "No changelog provided"
+    return "Changelog:\n " + "\n".join(
+        f"<b>{version}</b>\n- " + "\n- ".join(changes) for version, changes in versions.items()
+    )
 
 
-async def additions(
-    session: ClientSession,
-    api_key: str,
-    game_domain_name: str,
-    chat_id: str,
-    tg_token: str,
-    hide_adult_content: bool,
-    loop: bool,
-    topic_id: str,
-    frequency: int,
-) -> None:
-    state_file = "seen_mods.json"
-    seen_mods: set[int] = set(load_state(state_file) or [])  # pyright: ignore[reportGeneralTypeIssues]
-    new_mods_data = []
-    nm = NM(api_key, session)
-    tg = TG(session, tg_token)
-    categories = await nm.game_categories(game_domain_name)
-
-    while True:
-        print("Starting new mod check...")
-        tasks = []
-        mods = await nm.fetch_latest_mods(game_domain_name)
-        mods = [mod for mod in mods if mod["mod_id"] not in seen_mods and mod["available"]]
-        for mod in sorted(mods, key=lambda x: x["mod_id"]):
-            mod_id = mod["mod_id"]
-            seen_mods.add(mod_id)
-
-            if hide_adult_content and mod["contains_adult_content"]:
-                print("Mod contains adult content, skipping...")
-                continue
+def iter_records(body: bytes, *fields: str) -> Iterator[tuple[Any, ...]]:
+    # Error responses are objects like {"message": "..."} instead of a list
+    if not body.lstrip().startswith(b"["):
+        raise ValueError(f"Unexpected response: {body[:200]!r}")
+    # The body is read whole for the response cache anyway, and decoding it at once is faster than parsing it item by
+    # item, so only the requested fields are taken from each item afterwards
+    for item in json_loads(body):
+        yield tuple(item.get(field) for field in fields)
 
-            new_mod_data = {
-                "ID": mod_id,
-                "Author": mod["author"],
-                "Name": mod.get("name", "N/A"),
-                "Cagegory": categories[mod["category_id"]],
-                "Link": f"https://nexusmods.com/{mod['domain_name']}/mods/{mod['mod_id']}",
-            }
-            new_mods_data.append(new_mod_data)
-
-            if tg_token:
-                tasks.append(
-                    asyncio.create_task(
-                        tg.send_mod(
-                            chat_id=chat_id,
-                            mod_title=mod.get("name", "N/A"),
-                            mod_id=mod_id,
-                            mod_author=mod["author"],
-                            mod_game=mod["domain_name"],
-                            mod_category=categories[mod["category_id"]],
-                            content=mod["summary"],
-                            images=await nm.get_image_urls(mod_id),
-                            topic_id=topic_id,
-                        )
-                    )
-                )
 
-        if new_mods_data:
-            print("New mods found:")
-            print(tabulate(new_mods_data, headers="keys", tablefmt="pretty"))
-            new_mods_data.clear()
-        else:
-            print("No new mods found.")
+def mod_update_times(body: bytes) -> dict[int, int]:
+    return dict(iter_records(body, "mod_id", "latest_file_update"))
 
-        save_state(state_file, list(seen_mods)[-100:])
-        await asyncio.gather(*tasks)
-        if loop:
-            print(f"Sleeping for {frequency / 60} minute/s...")
-            time.sleep(frequency)
-        else:
+
+def tracked_mods_by_game(body: bytes) -> dict[str, list[tuple[int, bool]]]:
+    games: dict[str, list[tuple[int, bool]]] = defaultdict(list)
+    for mod_id, domain_name, is_adult in iter_records(body, "mod_id", "domain_name", "is_adult"):
+        games[domain_name].append((mod_id, bool(is_adult)))
+    return dict(games)
+
+
+async def run_until_stopped(
+    run: Awaitable[None], stopping: asyncio.Event, stop: Callable[[], None], timeout: float
+) -> None:
+    # Once stopping, the work is asked to finish and cancelled if it takes longer than the timeout. State is only saved
+    # for completed work, so whatever is cancelled is done again after a restart.
+    task = asyncio.ensure_future(run)
+    stopped = asyncio.create_task(stopping.wait())
+    try:
+        await asyncio.wait({task, stopped}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        stopped.cancel()
+    if not task.done():
+        stop()
+        try:
+            await asyncio.wait_for(task, timeout)
+        except asyncio.TimeoutError:
+            print(f"Not finished after {timeout:.0f}s, stopping anyway...")
+    if not task.cancelled():
+        task.result()
+
+
+async def gather_limited(coros: Iterable[Awaitable[T]], limit: int) -> list[T]:
+    # Like asyncio.gather (results in input order), but with at most `limit` awaitables running at once
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coro: Awaitable[T]) -> T:
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(run(coro) for coro in coros))
+
+
+def allocate_intervals(rates: list[float], budget: float, bounds: tuple[float, float]) -> list[float]:
+    # A mod is found half an interval after its release on average, so the total delay is the sum of rate * interval.
+    # For a given number of checks per hour it is smallest when each feed is checked in proportion to the square root
+    # of its rate. Feeds hitting the bounds are fixed there and the remaining checks are split among the others.
+    lowest, highest = 3600 / bounds[1], 3600 / bounds[0]
+    checks: dict[int, float] = {}
+    free = set(range(len(rates)))
+    while free:
+        remaining = max(0.0, budget - sum(checks.values()))
+        weights = {index: math.sqrt(rates[index]) for index in free}
+        total = sum(weights.values())
+        proposed = {
+            index: remaining * weight / total if total else remaining / len(free) for index, weight in weights.items()
+        }
+        clamped = {
+            index: min(max(value, lowest), highest)
+            for index, value in proposed.items()
+            if not lowest <= value <= highest
+        }
+        if not clamped:
+            checks.update(proposed)
             break
+        checks.update(clamped)
+        free -= clamped.keys()
+    return [3600 / checks[index] for index in range(len(rates))]
+
+
+def updated_period(since: float | None) -> Literal["1d", "1w", "1m"]:
+    # Narrowest period of updated.json that still covers everything since the last successful check
+    elapsed = time.time() - since + 60 * 60 if since else float("inf")
+    if elapsed <= 24 * 60 * 60:
+        return "1d"
+    if elapsed <= 7 * 24 * 60 * 60:
+        return "1w"
+    return "1m"
+
+
+def new_changelog_entries(
+    changelogs: dict[str, list[str]], known_versions: set[str], old_version: str, new_version: str
+) -> dict[str, list[str]]:
+    if known_versions:
+        return {version: changes for version, changes in changelogs.items() if version not in known_versions}
+    # Without a history only the versions listed after the last known one are new. If that one isn't listed at all,
+    # only the entry of the new version can be trusted.
+    if old_version in changelogs:
+        versions = list(changelogs)
+        return {version: changelogs[version] for version in versions[versions.index(old_version) + 1 :]}
+    return {new_version: changelogs[new_version]} if new_version in changelogs else {}
+
+
+def load_subscriptions(config_file: str | Path, default_chat_id: str = "") -> dict[tuple[str, str], dict[str, Any]]:
+    # Group by (game, feed) so every game is only fetched once no matter how many chats subscribed to it
+    config = load_state(config_file)
+    if not config or not config.get("subscriptions"):
+        raise ValueError(f"No subscriptions found in {config_file}")
+
+    groups: dict[tuple[str, str], dict[str, Any]] = {}
+    for entry in config["subscriptions"]:
+        feed = entry.get("feed", "additions")
+        if feed not in ("additions", "updates"):
+            raise ValueError(f"Invalid feed {feed!r} for game {entry.get('game')!r}")
+
+        group = groups.setdefault((entry["game"], feed), {"subscribers": [], "frequency": 0})
+        group["subscribers"].append(
+            Subscriber(
+                chat_id=str(entry.get("chat_id") or default_chat_id),
+                topic_id=str(entry.get("topic_id") or ""),
+                hide_adult_content=entry.get("hide_adult_content", False),
+            )
+        )
+        if frequency := entry.get("frequency", config.get("frequency", {}).get(feed, 0)):
+            group["frequency"] = min(group["frequency"] or frequency, frequency)
+    return groups
 
 
-async def updates(
-    session: ClientSession,
-    api_key: str,
+async def additions(
+    nm: NM,
+    queue: DeliveryQueue | None,
+    store: StateStore,
     game_domain_name: str,
-    chat_id: str,
-    tg_token: str,
-    hide_adult_content: bool,
-    loop: bool,
-    topic_id: str,
-    frequency: int,
-) -> None:
-    nm = NM(api_key, session)
-    tg = TG(session, tg_token)
-    cache_file_path = "update_cache.json"
-    local_cache: dict[int, dict[str, Any]] = {
-        int(mod_id): value for mod_id, value in (load_state(cache_file_path) or {}).items()
-    }
-    tracked_mod_ids: set[int] = set()
-    categories = await nm.game_categories(game_domain_name)
+    subscribers: list[Subscriber],
+    concurrency: int = 4,
+    backfill_limit: int = 200,
+) -> Callable[[], Awaitable[int]]:
+    seen_mods = store.seen_mods(game_domain_name)
+    # IDs in the current gap that were fetched without finding a published mod
+    probed: set[int] = set()
+    new_mods_data: list[ModSummary] = []
+    lock = asyncio.Lock()
+    await nm.game_categories(game_domain_name)
+    hide_adult_content = all(subscriber.hide_adult_content for subscriber in subscribers)
+
+    async def backfill(mods: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        # The latest added list only has the last few mods. If none of them was seen before, the mods between the newest
+        # seen one before the list and the list's oldest one may have been missed (eg. during downtime or a release
+        # wave) and are fetched one by one. Seen mods newer than the list's oldest one (eg. a pushed ID far ahead) don't
+        # hide the gap. IDs are handed out to drafts too, so most of the gap are unpublished, hidden or deleted mods.
+        # They are remembered and not fetched again.
+        if not backfill_limit or not mods or any(mod["mod_id"] in seen_mods for mod in mods):
+            return []
+        oldest = min(mod["mod_id"] for mod in mods)
+        if not (before := [mod_id for mod_id in seen_mods if mod_id < oldest]):
+            return []
+        gap = range(max(before) + 1, oldest)
+        probed.difference_update([mod_id for mod_id in probed if mod_id not in gap])
+        unprobed = (mod_id for mod_id in reversed(gap) if mod_id not in probed)
+        if not (missing := list(itertools.islice(unprobed, backfill_limit))):
+            return []
+        if skipped := len(gap) - len(probed) - len(missing):
+            print(f"[{game_domain_name}] Skipping {skipped} older missed mod/s...")
+        print(f"[{game_domain_name}] Fetching {len(missing)} missed mod/s...")
+        metrics.inc("mods_backfilled_total", "Missed mods fetched one by one", len(missing), game=game_domain_name)
+
+        async def fetch(mod_id: int) -> dict[str, Any]:
+            # A failed ID is skipped so the rest of the check still goes through, it is tried again if it was the
+            # connection and not the mod
+            try:
+                mod = await nm.fetch_mod(game_domain_name, mod_id)
+            except (asyncio.TimeoutError, ClientError) as e:
+                print(f"[{game_domain_name}] Could not fetch missed mod [id={mod_id}]: {e!r}")
+                return {}
+            except Exception as e:
+                print(f"[{game_domain_name}] Could not fetch missed mod [id={mod_id}]: {e}")
+                mod = {}
+            if not mod.get("available"):
+                probed.add(mod_id)
+            return mod
+
+        fetched = await gather_limited((fetch(mod_id) for mod_id in missing), concurrency)
+        return [mod for mod in fetched if "mod_id" in mod]
+
+    async def check(pushed: list[dict[str, Any]] | None = None) -> int:
+        # Pushed events are handled like a regular check, but never at the same time as one
+        async with lock:
+            print(f"[{game_domain_name}] Starting new mod check{' (pushed)' if pushed is not None else ''}...")
+            found = 0
+            try:
+                mods = pushed if pushed is not None else await nm.fetch_latest_mods(game_domain_name)
+                # Pushed events may be a single mod, only the polled list shows which mods were missed
+                if pushed is None:
+                    mods = [*mods, *await backfill(mods)]
+                mods = [mod for mod in mods if mod["mod_id"] not in seen_mods and mod["available"]]
+                mods.sort(key=lambda x: x["mod_id"])
+                metrics.inc(
+                    "mods_detected_total", "New and updated mods", len(mods), game=game_domain_name, feed="additions"
+                )
 
-    mods_with_new_version: list[dict[str, Any]] = []
+                all_images: dict[int, list[str]] = {}
+                # Digests have no images, so the mod pages of a burst aren't scraped
+                if queue and not queue.sends_digests(subscribers, [mod["contains_adult_content"] for mod in mods]):
+                    image_mod_ids = [
+                        mod["mod_id"] for mod in mods if not hide_adult_content or not mod["contains_adult_content"]
+                    ]
+                    all_images = dict(
+                        zip(
+                            image_mod_ids,
+                            await gather_limited(
+                                (nm.get_image_urls(game_domain_name, mod_id) for mod_id in image_mod_ids), concurrency
+                            ),
+                        )
+                    )
 
-    # Initial population of tracked mods (do this carefully to stay within API limits)
-    if not local_cache:
-        print("Fetching initial list of tracked mods...")
-        updated_mods = await nm.fetch_updated_mods(game_domain_name)
-        updated_mod_data = {mod["mod_id"]: mod["latest_file_update"] for mod in updated_mods}
+                # The queued messages and the seen mods are saved together, a check that is interrupted before is
+                # simply run again
+                with store.transaction():
+                    for mod in mods:
+                        mod_id = mod["mod_id"]
+
+                        if hide_adult_content and mod["contains_adult_content"]:
+                            print("Mod contains adult content, skipping...")
+                            continue
+
+                        summary = ModSummary.from_api(mod, nm.category(game_domain_name, mod["category_id"]))
+                        new_mods_data.append(summary)
+
+                        if queue:
+                            for subscriber in subscribers:
+                                if subscriber.hide_adult_content and summary.is_adult:
+                                    continue
+                                metrics.inc(
+                                    "mods_notified_total", "Mod notifications", game=game_domain_name, feed="additions"
+                                )
+                                queue.send_mod(
+                                    chat_id=subscriber.chat_id,
+                                    mod_title=summary.name,
+                                    mod_id=mod_id,
+                                    mod_author=summary.author,
+                                    mod_game=summary.game,
+                                    mod_category=summary.category,
+                                    content=mod["summary"],
+                                    images=all_images.get(mod_id, []),
+                                    topic_id=subscriber.topic_id,
+                                )
+                    store.add_seen_mods(game_domain_name, (mod["mod_id"] for mod in mods))
+                # Reloaded, so the pruned mods are dropped here as well
+                seen_mods.clear()
+                seen_mods.update(store.seen_mods(game_domain_name))
 
-        tracked_mods = await nm.fetch_tracked_mods(game_domain_name)
-        tracked_mod_ids = {mod["mod_id"] for mod in tracked_mods}
-        for mod_id in tracked_mod_ids:
-            mod_info = await nm.fetch_mod(game_domain_name, mod_id)
-            local_cache[mod_id] = {
-                "version": mod_info["version"],
-                "is_adult": mod_info["contains_adult_content"],
-                "latest_file_update": updated_mod_data.get(mod_id, None),
-            }
-        save_state(cache_file_path, local_cache)
-        print("Initial population of tracked mods complete.")
+                if new_mods_data:
+                    print(f"[{game_domain_name}] New mods found:")
+                    print(tabulate([mod.row() for mod in new_mods_data], headers=ModSummary.headers, tablefmt="pretty"))
+                    new_mods_data.clear()
+                else:
+                    print(f"[{game_domain_name}] No new mods found.")
 
-    while True:
-        new_mods = []
-        tasks = []
-        try:
-            print("Starting update check...")
-            # Fetch list of all recently updated mods
-            updated_mods = await nm.fetch_updated_mods(game_domain_name)
-            updated_mod_data = {mod["mod_id"]: mod["latest_file_update"] for mod in updated_mods}
+                found = len(mods)
+                print(f"[{game_domain_name}] API quota: {nm.rate_limiter}")
+            except Exception as e:
+                print(f"[{game_domain_name}] An error occurred: {e}")
+            return found
 
-            # Refresh the list of tracked mods
-            tracked_mods = await nm.fetch_tracked_mods(game_domain_name)
-            tracked_mod_ids = {mod["mod_id"] for mod in tracked_mods if not hide_adult_content or not mod["is_adult"]}
+    return check
 
-            for mod_id in tracked_mod_ids:
-                cached_latest_file_update: int | None = local_cache.get(mod_id, {}).get("latest_file_update", None)
-                new_latest_file_update: int | None = updated_mod_data.get(mod_id, None)
 
-                if mod_id not in local_cache:
-                    print(f"Tracking new mod [id={mod_id}], fetching...")
-                    mod_details = await nm.fetch_mod(game_domain_name, mod_id)
-                    local_cache[mod_id] = {
-                        "version": mod_details["version"],
-                        "latest_file_update": new_latest_file_update,
-                        "is_adult": mod_details["contains_adult_content"],
+async def updates(
+    nm: NM,
+    queue: DeliveryQueue | None,
+    store: StateStore,
+    game_domain_name: str,
+    subscribers: list[Subscriber],
+    concurrency: int = 4,
+) -> Callable[[], Awaitable[int]]:
+    local_cache = store.tracked_mods(game_domain_name)
+    await nm.game_categories(game_domain_name)
+    hide_adult_content = all(subscriber.hide_adult_content for subscriber in subscribers)
+
+    mods_with_new_version: list[tuple[Any, ...]] = []
+    tracked: dict[str, Any] = {"mods": None, "ids": set()}
+    lock = asyncio.Lock()
+
+    # Initial population of tracked mods (the rate limiter keeps this within API limits). It is saved in batches, so
+    # after an interruption only the remaining mods are fetched.
+    populating = store.last_run(game_domain_name, "populate")
+    if not local_cache or (populating is not None and store.last_run(game_domain_name, "updates") is None):
+        print(f"[{game_domain_name}] Fetching initial list of tracked mods...")
+        started = populating or time.time()
+        store.save_last_run(game_domain_name, "populate", started)
+        updated_mod_data = await nm.fetch_updated_mods(game_domain_name)
+        tracked_mods = await nm.fetch_tracked_mods(game_domain_name)
+        sorted_mod_ids = sorted({mod_id for mod_id, _ in tracked_mods} - local_cache.keys())
+        for index in range(0, len(sorted_mod_ids), 100):
+            batch = sorted_mod_ids[index : index + 100]
+            mod_infos = await gather_limited((nm.fetch_mod(game_domain_name, mod_id) for mod_id in batch), concurrency)
+            populated = {
+                mod_id: TrackedModState(
+                    mod_info["version"], updated_mod_data.get(mod_id), mod_info["contains_adult_content"]
+                )
+                for mod_id, mod_info in zip(batch, mod_infos)
+            }
+            store.save_tracked_mods(game_domain_name, populated)
+            local_cache.update(populated)
+        # Updates made while populating are picked up by the first check
+        store.save_last_run(game_domain_name, "updates", started)
+        print(f"[{game_domain_name}] Initial population of tracked mods complete.")
+
+    async def check(pushed: list[dict[str, Any]] | None = None) -> int:
+        # Pushed events are handled like a regular check, but never at the same time as one
+        async with lock:
+            new_mods: list[ModSummary] = []
+            found = 0
+            try:
+                started = time.time()
+                last_run = store.last_run(game_domain_name, "updates")
+                if pushed is not None:
+                    print(f"[{game_domain_name}] Starting update check (pushed)...")
+                    updated_mod_data = {mod["mod_id"]: mod["latest_file_update"] for mod in pushed}
+                else:
+                    time_period = updated_period(last_run)
+                    print(f"[{game_domain_name}] Starting update check (period {time_period})...")
+                    # Fetch list of all mods updated since the last check
+                    updated_mod_data = await nm.fetch_updated_mods(game_domain_name, time_period)
+
+                # Refresh the list of tracked mods, newly tracked mods can only show up when it changed
+                new_mod_ids = []
+                tracked_mods = await nm.fetch_tracked_mods(game_domain_name)
+                if tracked_mods is not tracked["mods"]:
+                    tracked["ids"] = {
+                        mod_id for mod_id, is_adult in tracked_mods if not hide_adult_content or not is_adult
                     }
-                    new_mods.append(
-                        {
-                            "Author": mod_details["author"],
-                            "Name": mod_details["name"],
-                            "Link": f"https://nexusmods.com/{game_domain_name}/mods/{mod_id}",
-                        }
-                    )
-                    continue
-
-                # If the latest_file_update has changed or is new, there might be a new version
-                if new_latest_file_update and cached_latest_file_update != new_latest_file_update:
-                    mod_details = await nm.fetch_mod(game_domain_name, mod_id)
-                    new_version = mod_details["version"]
-                    old_version = local_cache.get(mod_id, {}).get("version", None)
-
-                    if old_version and new_version and old_version != new_version:
-                        print(f"Mod [id={mod_id}] has been updated to from {old_version} to {new_version}")
-                        changelogs = await nm.fetch_mod_changelogs(game_domain_name, mod_id)
-                        last_version_index = (
-                            list(changelogs.keys()).index(old_version) if old_version in changelogs else -2
-                        )
+                    new_mod_ids = sorted(tracked["ids"] - local_cache.keys())
+                tracked_mod_ids: set[int] = tracked["ids"]
+
+                # Only mods in the delta whose latest_file_update has changed or is new might have a new version
+                changed_mod_ids = sorted(
+                    mod_id
+                    for mod_id, latest_file_update in updated_mod_data.items()
+                    if latest_file_update
+                    and mod_id in tracked_mod_ids
+                    and mod_id in local_cache
+                    and local_cache[mod_id].latest_file_update != latest_file_update
+                )
+                if pushed is None and (last_run is None or time.time() - last_run > 30 * 24 * 60 * 60):
+                    # Older updates than a month aren't listed anymore, so all other tracked mods have to be checked
+                    print(f"[{game_domain_name}] Last check is older than a month, checking all tracked mods...")
+                    changed_mod_ids = sorted(set(changed_mod_ids) | (tracked_mod_ids & local_cache.keys()))
 
-                        new_versions = dict(list(changelogs.items())[last_version_index + 1 :])
+                for mod_id in new_mod_ids:
+                    print(f"Tracking new mod [id={mod_id}], fetching...")
+                mod_details_list = await gather_limited(
+                    (nm.fetch_mod(game_domain_name, mod_id) for mod_id in new_mod_ids + changed_mod_ids), concurrency
+                )
+                all_mod_details = dict(zip(new_mod_ids + changed_mod_ids, mod_details_list))
+
+                updated_mod_ids = [
+                    mod_id
+                    for mod_id in changed_mod_ids
+                    if local_cache[mod_id].version
+                    and all_mod_details[mod_id]["version"]
+                    and local_cache[mod_id].version != all_mod_details[mod_id]["version"]
+                ]
+                metrics.inc(
+                    "mods_detected_total",
+                    "New and updated mods",
+                    len(updated_mod_ids),
+                    game=game_domain_name,
+                    feed="updates",
+                )
+                # Digests have no images, so the mod pages of a burst aren't scraped
+                scrape = queue and not queue.sends_digests(
+                    subscribers, [all_mod_details[mod_id]["contains_adult_content"] for mod_id in updated_mod_ids]
+                )
+                changelogs_list, images_list = await asyncio.gather(
+                    gather_limited(
+                        (nm.fetch_mod_changelogs(game_domain_name, mod_id) for mod_id in updated_mod_ids), concurrency
+                    ),
+                    gather_limited(
+                        (nm.get_image_urls(game_domain_name, mod_id) for mod_id in (updated_mod_ids if scrape else [])),
+                        concurrency,
+                    ),
+                )
+                all_changelogs = dict(zip(updated_mod_ids, changelogs_list))
+                all_images = dict(zip(updated_mod_ids, images_list))
+                known_versions = store.mod_versions(game_domain_name, updated_mod_ids)
+
+                # The queued messages and the state they advance are saved together, so an interrupted check neither
+                # loses nor repeats notifications, and the cached state is only changed once they are saved
+                changes: dict[int, TrackedModState] = {}
+                with store.transaction():
+                    for mod_id in new_mod_ids:
+                        mod_details = all_mod_details[mod_id]
+                        changes[mod_id] = TrackedModState(
+                            mod_details["version"], updated_mod_data.get(mod_id), mod_details["contains_adult_content"]
+                        )
+                        new_mods.append(
+                            ModSummary.from_api(mod_details, nm.category(game_domain_name, mod_details["category_id"]))
+                        )
 
-                        if tg_token:
-                            changelog_text = "\n".join(
-                                "<b>{}</b>\n- {}".format(version, "\n- ".join(changelog))
-                                for version, changelog in new_versions.items()
+                    for mod_id in changed_mod_ids:
+                        mod_details = all_mod_details[mod_id]
+                        summary = ModSummary.from_api(
+                            mod_details, nm.category(game_domain_name, mod_details["category_id"])
+                        )
+                        new_version = mod_details["version"]
+                        old_version = local_cache[mod_id].version or ""
+
+                        if mod_id in all_changelogs:
+                            print(f"Mod [id={mod_id}] has been updated to from {old_version} to {new_version}")
+                            changelogs = all_changelogs[mod_id] or {}
+                            new_versions = new_changelog_entries(
+                                changelogs, known_versions[mod_id], old_version, new_version
                             )
-                            tasks.append(
-                                asyncio.create_task(
-                                    tg.send_mod(
-                                        chat_id=chat_id,
-                                        mod_title=mod_details.get("name", "N/A"),
+                            known_versions[mod_id].update(changelogs, [old_version, new_version])
+
+                            if queue:
+                                changelog = render_changelog(new_versions)
+                                for subscriber in subscribers:
+                                    if subscriber.hide_adult_content and summary.is_adult:
+                                        continue
+                                    metrics.inc(
+                                        "mods_notified_total",
+                                        "Mod notifications",
+                                        game=game_domain_name,
+                                        feed="updates",
+                                    )
+                                    queue.send_mod(
+                                        chat_id=subscriber.chat_id,
+                                        mod_title=summary.name,
                                         mod_id=mod_id,
-                                        mod_author=mod_details["author"],
-                                        mod_game=mod_details["domain_name"],
+                                        mod_author=summary.author,
+                                        mod_game=summary.game,
                                         mod_old_version=old_version,
                                         mod_new_version=new_version,
-                                        mod_category=categories[mod_details["category_id"]],
-                                        content=(
-                                            "Changelog:\n " + changelog_text
-                                            if changelog_text
-                                            else "No changelog provided"
-                                        ),
-                                        images=await nm.get_image_urls(mod_id),
-                                        topic_id=topic_id,
+                                        mod_category=summary.category,
+                                        content=changelog,
+                                        images=all_images.get(mod_id, []),
+                                        topic_id=subscriber.topic_id,
                                     )
-                                )
-                            )
 
-                        for version in new_versions:
-                            mods_with_new_version.append(
-                                {
-                                    "ID": mod_id,
-                                    "Author": mod_details["author"],
-                                    "Name": mod_details["name"],
-                                    "Category": categories[mod_details["category_id"]],
-                                    "Link": f"https://nexusmods.com/{mod_details['domain_name']}/mods/{mod_id}",
-                                    "Old Version": old_version or "N/A",
-                                    "New Version": version,
-                                }
-                            )
+                            for version in new_versions or [new_version]:
+                                mods_with_new_version.append((*summary.row(), old_version or "N/A", version))
 
-                    local_cache[mod_id] = {
-                        "version": new_version,
-                        "latest_file_update": new_latest_file_update,
-                        "is_adult": mod_details["contains_adult_content"],
-                    }
+                        changes[mod_id] = TrackedModState(
+                            new_version,
+                            updated_mod_data.get(mod_id, local_cache[mod_id].latest_file_update),
+                            mod_details["contains_adult_content"],
+                        )
 
-            save_state(cache_file_path, local_cache)
-            if new_mods:
-                message = "New mods found:\n" + "\n".join(
-                    f'<a href="{mod["Link"]}">{mod["Name"]}</a> - {mod["Author"]}\n' for mod in new_mods
+                    store.save_tracked_mods(game_domain_name, changes)
+                    store.add_mod_versions(game_domain_name, known_versions)
+                    if new_mods and queue:
+                        for subscriber in subscribers:
+                            visible_mods = [
+                                mod for mod in new_mods if not subscriber.hide_adult_content or not mod.is_adult
+                            ]
+                            if not visible_mods:
+                                continue
+                            message = "New mods found:\n" + "\n".join(
+                                f'<a href="{mod.link}">{mod.name}</a> - {mod.author}\n' for mod in visible_mods
+                            )
+                            queue.send_message(
+                                chat_id=subscriber.chat_id,
+                                text=message,
+                                topic_id=subscriber.topic_id,
+                                disable_web_page_preview=True,
+                            )
+                    # Pushed events only cover some mods, polling still has to pick up everything since its last run
+                    if pushed is None:
+                        store.save_last_run(game_domain_name, "updates", started)
+                local_cache.update(changes)
+                tracked["mods"] = tracked_mods
+                found = len(new_mod_ids) + len(updated_mod_ids)
+                print(f"[{game_domain_name}] API quota: {nm.rate_limiter}")
+
+            except Exception as e:
+                print(f"[{game_domain_name}] An error occurred: {e}")
+
+            if mods_with_new_version:
+                print(f"[{game_domain_name}] Updated mods:")
+                print(
+                    tabulate(
+                        mods_with_new_version,
+                        headers=(*ModSummary.headers, "Old Version", "New Version"),
+                        tablefmt="pretty",
+                    )
                 )
-                await tg.send_message(
-                    chat_id=chat_id,
-                    text=message,
-                    topic_id=topic_id,
-                    disable_web_page_preview=True,
+                mods_with_new_version.clear()
+            else:
+                print(f"[{game_domain_name}] No updated mods found.")
+            return found
+
+    return check
+
+
+def set_up_on_first_run(
+    name: str, set_up: Callable[[], Awaitable[Callable[..., Awaitable[int]]]]
+) -> Callable[..., Awaitable[int]]:
+    # Feeds are set up in their first check, which the scheduler runs for all of them at once. A game with a long setup
+    # (eg. thousands of tracked mods to populate) doesn't hold up the others, and one that fails is tried again at its
+    # next check instead of stopping the daemon.
+    run: Callable[..., Awaitable[int]] | None = None
+    lock = asyncio.Lock()
+
+    async def check(*args: Any) -> int:
+        nonlocal run
+        async with lock:
+            if run is None:
+                try:
+                    run = await set_up()
+                except Exception as e:
+                    print(f"[{name}] Could not set up: {e}")
+                    return 0
+        return await run(*args)
+
+    return check
+
+
+async def daemon(
+    nm: NM,
+    queue: DeliveryQueue | None,
+    store: StateStore,
+    scheduler: Scheduler,
+    config_file: str,
+    default_chat_id: str,
+    concurrency: int = 4,
+    backfill_limit: int = 200,
+    shard: tuple[int, int] = (0, 1),
+) -> None:
+    groups = load_subscriptions(config_file, default_chat_id)
+
+    for index, ((game_domain_name, feed), group) in enumerate(sorted(groups.items())):
+        # With multiple workers, each one runs every n-th subscription
+        if index % shard[1] != shard[0]:
+            continue
+        print(f"[{game_domain_name}] Running {feed} for {len(group['subscribers'])} subscriber/s")
+        store.migrate_json_state(
+            game_domain_name, f"seen_mods_{game_domain_name}.json", f"update_cache_{game_domain_name}.json"
+        )
+        match feed:
+            case "additions":
+                scheduler.add(
+                    f"{game_domain_name}/additions",
+                    group["frequency"] or 300,
+                    set_up_on_first_run(
+                        f"{game_domain_name}/additions",
+                        partial(
+                            additions,
+                            nm=nm,
+                            queue=queue,
+                            store=store,
+                            game_domain_name=game_domain_name,
+                            subscribers=group["subscribers"],
+                            concurrency=concurrency,
+                            backfill_limit=backfill_limit,
+                        ),
+                    ),
+                )
+            case "updates":
+                scheduler.add(
+                    f"{game_domain_name}/updates",
+                    group["frequency"] or 3600,
+                    set_up_on_first_run(
+                        f"{game_domain_name}/updates",
+                        partial(
+                            updates,
+                            nm=nm,
+                            queue=queue,
+                            store=store,
+                            game_domain_name=game_domain_name,
+                            subscribers=group["subscribers"],
+                            concurrency=concurrency,
+                        ),
+                    ),
                 )
-            await asyncio.gather(*tasks)
-
-        except Exception as e:
-            print(f"An error occurred: {e}")
 
-        if mods_with_new_version:
-            print("Updated mods:")
-            print(tabulate(mods_with_new_version, headers="keys", tablefmt="pretty"))
-            mods_with_new_version.clear()
-        else:
-            print("No updated mods found.")
 
-        if loop:
-            print(f"Sleeping for {frequency / 60 / 60} hour/s...")
-            time.sleep(frequency)
-        else:
-            break
+async def supervise(
+    workers: int, queue: DeliveryQueue | None, stopping: asyncio.Event, poll_interval: float = 2
+) -> None:
+    # Every worker process runs a shard of the subscriptions with the same arguments, sharing the state database.
+    # Messages are only sent from here, so every notification is sent exactly once.
+    processes: dict[int, asyncio.subprocess.Process] = {}
+
+    async def worker(shard: int) -> None:
+        while not stopping.is_set():
+            process = processes[shard] = await asyncio.create_subprocess_exec(
+                sys.executable, sys.argv[0], "--shard", str(shard), *sys.argv[1:]
+            )
+            try:
+                code = await process.wait()
+            finally:
+                if process.returncode is None:
+                    process.terminate()
+            if code == 0 or stopping.is_set():
+                return
+            print(f"Worker {shard} exited with code {code}, restarting in 10s...")
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(stopping.wait(), 10)
+
+    async def stop() -> None:
+        # The workers shut down like a single process, finishing their running checks first
+        await stopping.wait()
+        for process in processes.values():
+            if process.returncode is None:
+                process.terminate()
+
+    async def deliver() -> None:
+        while True:
+            if queue:
+                queue.resume()
+            await asyncio.sleep(poll_interval)
+
+    print(f"Starting {workers} workers...")
+    tasks = [asyncio.create_task(deliver()), asyncio.create_task(stop())]
+    try:
+        await asyncio.gather(*(worker(shard) for shard in range(workers)))
+    finally:
+        for task in tasks:
+            task.cancel()
+    if queue:
+        queue.resume()
 
 
 async def main() -> None:
     parser = argparse.ArgumentParser()
     parser.add_argument("-k", "--api-key", required=True, help="API key for Nexus Mods")
-    parser.add_argument("-g", "--game-name", required=True, help="Game domain name for Nexus Mods, eg. 'starfield'")
+    parser.add_argument("-g", "--game-name", help="Game domain name for Nexus Mods, eg. 'starfield'")
     parser.add_argument("-c", "--chat-id", help="Telegram chat ID")
     parser.add_argument("-t", "--tg-token", help="Telegram bot token")
     parser.add_argument("-o", "--topic-id", help="Telegram group topic ID", default="")
@@ -422,6 +2052,94 @@ async def main() -> None:
         default=0,
         type=int,
     )
+    parser.add_argument(
+        "-r",
+        "--rate-limit",
+        help="Maximum Nexus Mods API requests per second (default: 5)",
+        default=5,
+        type=float,
+    )
+    parser.add_argument(
+        "-b",
+        "--check-budget",
+        help="Checks per hour to spread across feeds by how often they find mods, 0 for fixed frequencies (default: 0)",
+        default=0,
+        type=float,
+    )
+    parser.add_argument(
+        "--min-interval", help="Shortest interval between checks with a budget (default: 60s)", default=60, type=float
+    )
+    parser.add_argument(
+        "--max-interval",
+        help="Longest interval between checks with a budget (default: 3600s)",
+        default=3600,
+        type=float,
+    )
+    parser.add_argument(
+        "-n",
+        "--concurrency",
+        help="Maximum number of concurrent per-mod requests (default: 4)",
+        default=4,
+        type=int,
+    )
+    parser.add_argument(
+        "--backfill-limit",
+        help="Maximum number of missed new mods to fetch one by one after downtime, 0 to disable (default: 200)",
+        default=200,
+        type=int,
+    )
+    parser.add_argument(
+        "-d",
+        "--digest-threshold",
+        help="Send waiting mods as a digest once this many are queued for a chat, 0 to disable (default: 10)",
+        default=10,
+        type=int,
+    )
+    parser.add_argument("-s", "--state", help="Path to the state database (default: state.db)", default="state.db")
+    parser.add_argument(
+        "--api-connections", help="Maximum connections to the Nexus Mods API (default: 8)", default=8, type=int
+    )
+    parser.add_argument(
+        "--web-connections",
+        help="Maximum connections to the Nexus Mods website, scraped for images (default: 4)",
+        default=4,
+        type=int,
+    )
+    parser.add_argument("--tg-connections", help="Maximum connections to Telegram (default: 8)", default=8, type=int)
+    parser.add_argument(
+        "--timeout", help="Seconds to wait for data from a server before failing (default: 30)", default=30, type=float
+    )
+    parser.add_argument(
+        "--connect-timeout", help="Seconds to wait for a connection (default: 10)", default=10, type=float
+    )
+    parser.add_argument(
+        "--total-timeout", help="Seconds a whole request may take (default: 120)", default=120, type=float
+    )
+    parser.add_argument(
+        "--keepalive", help="Seconds to keep idle connections open (default: 30)", default=30, type=float
+    )
+    parser.add_argument("--dns-ttl", help="Seconds to cache DNS lookups (default: 300)", default=300, type=int)
+    parser.add_argument("--metrics-port", help="Serve Prometheus metrics on this port", type=int)
+    parser.add_argument("--metrics-file", help="Write Prometheus metrics to this file (textfile collector)")
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="Number of worker processes the daemon's subscriptions are split across (default: 1)",
+        default=1,
+        type=int,
+    )
+    parser.add_argument("--shard", help=argparse.SUPPRESS, type=int)
+    parser.add_argument("--ingest-port", help="Accept pushed mod events on this port", type=int)
+    parser.add_argument("--ingest-token", help="Bearer token required for pushed mod events", default="")
+    parser.add_argument(
+        "--ingest-host", help="Address to accept pushed mod events on (default: 127.0.0.1)", default="127.0.0.1"
+    )
+    parser.add_argument(
+        "--shutdown-timeout",
+        help="Seconds to wait for running checks and then for messages being sent on SIGINT/SIGTERM (default: 30)",
+        default=30,
+        type=float,
+    )
 
     sub_parser = parser.add_subparsers(dest="command")
     sub_parser.required = True
@@ -432,48 +2150,179 @@ async def main() -> None:
     updates_parser = sub_parser.add_parser("updates", help="Get updates for new updates")
     updates_parser.set_defaults(command="updates")
 
+    daemon_parser = sub_parser.add_parser("daemon", help="Run all subscriptions of a config file in one process")
+    daemon_parser.add_argument("config", help="Path to the subscriptions config file, eg. 'subscriptions.json'")
+    daemon_parser.set_defaults(command="daemon")
+
     args = parser.parse_args()
 
-    if (args.tg_token or args.chat_id) and (not args.tg_token or not args.chat_id):
+    if args.command != "daemon" and not args.game_name:
+        print("Game name must be provided")
+        exit(1)
+
+    if args.command != "daemon" and (args.tg_token or args.chat_id) and (not args.tg_token or not args.chat_id):
         print("Both chat ID and Telegram token must be provided")
         exit(1)
 
+    if args.workers > 1 and args.command != "daemon":
+        print("Multiple workers are only supported by the daemon")
+        exit(1)
+
     if not args.tg_token:
         print("Telegram token not provided, not sending messages")
 
-    async with ClientSession() as session:
+    supervisor = args.workers > 1 and args.shard is None
+    if args.shard is not None:
+        # Workers serve their own metrics and pushed events, on the ports following the supervisor's one
+        if args.metrics_port:
+            args.metrics_port += 1 + args.shard
+        if args.ingest_port:
+            args.ingest_port += args.shard
+        if args.metrics_file:
+            metrics_file = Path(args.metrics_file)
+            args.metrics_file = str(metrics_file.with_stem(f"{metrics_file.stem}-{args.shard}"))
+
+    subscribers = [Subscriber(args.chat_id, args.topic_id, args.hide_adult_content)]
+
+    # On the first signal running checks and messages being sent are finished. Before the checks run (the initial
+    # population is saved in batches) and on a second Ctrl+C the notifier exits right away.
+    main_task = asyncio.current_task()
+    stopping = asyncio.Event()
+    running = False
+
+    def stop(sig: signal.Signals) -> None:
+        if main_task and (not running or (stopping.is_set() and sig == signal.SIGINT)):
+            main_task.cancel()
+        elif not stopping.is_set():
+            print(f"Received {sig.name}, shutting down...")
+        stopping.set()
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with suppress(NotImplementedError):
+            asyncio.get_running_loop().add_signal_handler(sig, stop, sig)
+
+    store = StateStore(args.state)
+    if args.command != "daemon":
+        store.migrate_json_state(args.game_name, "seen_mods.json", "update_cache.json")
+
+    session_options = {
+        "timeout": args.timeout,
+        "connect_timeout": args.connect_timeout,
+        "total_timeout": args.total_timeout,
+        "keepalive": args.keepalive,
+        "dns_ttl": args.dns_ttl,
+    }
+    async with (
+        client_session(args.api_connections, **session_options) as api_session,
+        client_session(args.web_connections, **session_options) as web_session,
+        client_session(args.tg_connections, **session_options) as tg_session,
+    ):
+        # The workers split the request rate, the remaining quota is reported to all of them by the API itself
+        rate = args.rate_limit / args.workers
+        rate_limiter = RateLimiter(rate=rate, burst=max(1, int(rate * 2)))
+        nm = NM(args.api_key, api_session, rate_limiter, store, web_session=web_session)
+        queue = (
+            DeliveryQueue(
+                TG(tg_session, args.tg_token),
+                store,
+                digest_threshold=args.digest_threshold,
+                deliver=args.shard is None,
+            )
+            if args.tg_token
+            else None
+        )
+        if queue:
+            queue.resume()
+
+        # Like the request rate, the check budget is split between the workers
+        scheduler = Scheduler(budget=args.check_budget / args.workers, bounds=(args.min_interval, args.max_interval))
+
         match args.command:
             case "additions":
-                await additions(
-                    session=session,
-                    api_key=args.api_key,
-                    game_domain_name=args.game_name,
-                    chat_id=args.chat_id,
-                    tg_token=args.tg_token,
-                    hide_adult_content=args.hide_adult_content,
-                    loop=not args.no_loop,
-                    topic_id=args.topic_id,
-                    frequency=args.frequency or 300,
+                scheduler.add(
+                    f"{args.game_name}/additions",
+                    args.frequency or 300,
+                    await additions(
+                        nm=nm,
+                        queue=queue,
+                        store=store,
+                        game_domain_name=args.game_name,
+                        subscribers=subscribers,
+                        concurrency=args.concurrency,
+                        backfill_limit=args.backfill_limit,
+                    ),
                 )
             case "updates":
-                await updates(
-                    session=session,
-                    api_key=args.api_key,
-                    game_domain_name=args.game_name,
-                    chat_id=args.chat_id,
-                    tg_token=args.tg_token,
-                    hide_adult_content=args.hide_adult_content,
-                    loop=not args.no_loop,
-                    topic_id=args.topic_id,
-                    frequency=args.frequency or 3600,
+                scheduler.add(
+                    f"{args.game_name}/updates",
+                    args.frequency or 3600,
+                    await updates(
+                        nm=nm,
+                        queue=queue,
+                        store=store,
+                        game_domain_name=args.game_name,
+                        subscribers=subscribers,
+                        concurrency=args.concurrency,
+                    ),
                 )
+            case "daemon":
+                # The supervisor only delivers the messages, the subscriptions run in the worker processes
+                if not supervisor:
+                    await daemon(
+                        nm=nm,
+                        queue=queue,
+                        store=store,
+                        scheduler=scheduler,
+                        config_file=args.config,
+                        default_chat_id=args.chat_id or "",
+                        concurrency=args.concurrency,
+                        backfill_limit=args.backfill_limit,
+                        shard=(args.shard or 0, args.workers),
+                    )
             case _:
                 print("Invalid command")
 
+        metrics_runner = await metrics.serve(args.metrics_port) if args.metrics_port else None
+        ingest_runner = (
+            await scheduler.serve(args.ingest_port, args.ingest_token, args.ingest_host)
+            if args.ingest_port and not args.no_loop and not supervisor
+            else None
+        )
+        metrics_writer = (
+            asyncio.create_task(metrics.write_periodically(args.metrics_file))
+            if args.metrics_file and not args.no_loop
+            else None
+        )
+
+        running = True
+        if supervisor:
+            await supervise(args.workers, queue, stopping)
+        else:
+            await run_until_stopped(
+                scheduler.run_once() if args.no_loop else scheduler.run(),
+                stopping,
+                scheduler.stop,
+                args.shutdown_timeout,
+            )
+        # Everything is sent after a single run, when stopping only the messages already being sent
+        if queue:
+            await run_until_stopped(queue.drain(), stopping, queue.stop, args.shutdown_timeout)
+        if args.metrics_file and (supervisor or args.no_loop):
+            metrics.write(args.metrics_file)
+
+        if metrics_writer:
+            metrics_writer.cancel()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        if ingest_runner:
+            await ingest_runner.cleanup()
+
+    store.close()
+
 
 if __name__ == "__main__":
     try:
         asyncio.run(main())
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, asyncio.CancelledError):
         print("\rExiting...")
         exit(0)